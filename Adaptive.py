@@ -0,0 +1,133 @@
+import time
+import numpy as np
+from Simulation import Simulation
+from Tree import Tree
+from Instrumentation import Callback, Callbacks, TimerCallback, Stage
+
+class Adaptive():
+    """
+    Tree price with as many paths as needed for a target standard error
+
+    Paths are generated in batches of `batch_size`, batch `j` being chunk `j` of
+    `Simulation.generate` with the same seed and `chunk_size=batch_size`. Every batch is binned
+    and priced on its own tree, the standard error of the price is estimated by batch means,
+    the standard deviation of the batch prices divided by the square root of their number. As
+    soon as it reaches `tol`, or the time or path budget is used up, the paths of all batches are
+    binned and priced together.
+
+    Parameters
+    ----------
+    S0, T, r, sigma, M, sampler:
+        see `Simulation.generate`
+    nbins: int
+        Number of bins per timestep
+    method: {"fixed", "kmeans", "kmeans1d", "kmeans_warm"}
+        Binning method
+    batch_size: int
+        Number of paths per batch
+    seed: int, optional
+        Seed of the batches, drawn from numpy's global random state if None
+    callback: Callback, optional
+        Receives the metrics of all stages, see `Instrumentation`
+
+    Attributes
+    ----------
+    option_price: float
+        Price on the tree of all paths
+    batch_price: float
+        Mean of the batch prices
+    stderr: float
+        Standard error by batch means
+    n_paths: int
+    seconds: float
+    stages: pd.DataFrame
+        Seconds and calls of every stage (generate, binning, create_edgelist, Tree.from_S,
+        calc_option_value)
+    S: Simulation
+        Simulation of all paths
+    tree: Tree
+        Tree of all paths
+    """
+
+    def __init__(self, S0=100., T=1.0, r=0.05, sigma=0.2, M=20, nbins=4, method="fixed", batch_size=10000,
+            seed=None, sampler="pseudo", callback=None):
+        self.params = {"S0": S0, "T": T, "r": r, "sigma": sigma, "M": M}
+        self.nbins = nbins
+        self.method = method
+        self.batch_size = batch_size
+        self.seed = int(np.random.randint(2**32)) if seed is None else seed
+        self.sampler = sampler
+        self.callback = Callback() if callback is None else callback
+        self.batch_prices = []
+        self.option_price = self.batch_price = self.stderr = None
+        self.n_paths = 0
+        self.seconds = None
+        self.stages = None
+        self.S = self.tree = None
+
+    def price(self, data, strike, discount, type, opt, callback):
+        """
+        Tree price of the paths `data`
+        """
+        S = Simulation(cache=False, callback=callback)
+        S.data = data
+        S.binning(nbins=self.nbins, method=self.method).create_edgelist()
+        tree = Tree(callback=callback).from_S(S).calc_option_value(strike, discount, type, opt)
+        return S, tree
+
+    def run(self, strike, discount=None, type="call", opt="european", tol=0.01, max_time=None, max_paths=10**7,
+            min_batches=4):
+        """
+        Add batches until the standard error is at most `tol` or a budget is used up
+
+        Parameters
+        ----------
+        strike: float
+            Strike price of the option
+        discount: float, optional
+            Discount factor for one timestep, defaults to `exp(-r*T/M)`
+        type: {"call", "put"}
+        opt: {"european", "american"}
+        tol: float
+            Target standard error of the price
+        max_time: float, optional
+            Seconds after which no further batch is started
+        max_paths: int
+            Largest number of paths
+        min_batches: int
+            Number of batches before the standard error is trusted, at least 2
+
+        Returns
+        -------
+        Adaptive
+        """
+        p = self.params
+        discount = np.exp(-p["r"]*p["T"]/p["M"]) if discount is None else discount
+        timer = TimerCallback()
+        callback = Callbacks(timer, self.callback)
+        start = time.perf_counter()
+        chunks = []
+        self.batch_prices = []
+        while True:
+            with Stage(callback, "generate") as s:
+                chunks.append(Simulation.generate_chunk(p["S0"], p["T"], p["r"], p["sigma"], p["M"], self.batch_size,
+                    self.seed, len(chunks), self.sampler))
+                s.metrics["items"] = self.batch_size
+            self.batch_prices.append(self.price(chunks[-1], strike, discount, type, opt, callback)[1].option_price)
+            n = len(self.batch_prices)
+            self.stderr = np.std(self.batch_prices, ddof=1)/np.sqrt(n) if n > 1 else np.inf
+            if n >= max(2, min_batches) and self.stderr <= tol:
+                break
+            if max_time is not None and time.perf_counter()-start >= max_time:
+                break
+            if (n+1)*self.batch_size > max_paths:
+                break
+
+        self.S, self.tree = self.price(np.concatenate(chunks, axis=1), strike, discount, type, opt, callback)
+        self.option_price = self.tree.option_price
+        self.batch_price = float(np.mean(self.batch_prices))
+        self.n_paths = len(chunks)*self.batch_size
+        self.seconds = time.perf_counter()-start
+        self.stages = timer.frame().groupby("stage", sort=False)["seconds"].agg(["sum", "count"]).rename(
+            columns={"sum": "seconds", "count": "calls"})
+        return self
@@ -0,0 +1,134 @@
+import numpy as np
+from collections.abc import Mapping
+
+class Bins(Mapping):
+    """
+    Compact representation of the bins of every timestep
+
+    Every attribute is an array of shape `(timesteps, nbins)`. Timesteps with less than
+    `nbins` bins are padded with empty bins (`count` 0, NaN statistics) at the end.
+
+    The object can be used like the former `bin_data` dict of the form
+    `t{i}: {bin{idx}: [...]}`. The elements of a bin are looked up from `data` on access;
+    without `data` a bin is represented by its bounds `[lo, hi]`.
+
+    Attributes
+    ----------
+    lo, hi: np.ndarray
+        Smallest and largest element of every bin
+    mean, median: np.ndarray
+        Mean and median of the elements of every bin
+    count: np.ndarray
+        Number of elements of every bin
+    data: np.ndarray or None
+        Binned data of shape `(timesteps, I)`
+    """
+
+    def __init__(self, lo, hi, mean, median, count, data=None):
+        self.lo = np.asarray(lo, dtype=float)
+        self.hi = np.asarray(hi, dtype=float)
+        self.mean = np.asarray(mean, dtype=float)
+        self.median = np.asarray(median, dtype=float)
+        self.count = np.asarray(count, dtype=np.int64)
+        self.data = data
+
+    @classmethod
+    def from_timesteps(cls, stats, data=None):
+        """
+        Create a Bins object from the statistics of every timestep
+
+        Parameters
+        ----------
+        stats: list
+            One dict per timestep as returned by `summarize`
+        data: np.ndarray, optional
+            Binned data
+
+        Returns
+        -------
+        Bins
+        """
+        nbins = max(len(s["count"]) for s in stats)
+        res = {}
+        for key, fill in [("lo", np.nan), ("hi", np.nan), ("mean", np.nan), ("median", np.nan), ("count", 0)]:
+            res[key] = np.full((len(stats), nbins), fill, dtype=np.int64 if key == "count" else float)
+            for i, s in enumerate(stats):
+                res[key][i, :len(s[key])] = s[key]
+        return cls(**res, data=data)
+
+    @staticmethod
+    def summarize(S_t, starts, is_sorted=False):
+        """
+        Statistics of bins given by ranks
+
+        Bin `b` holds the elements with the ranks `starts[b]` to `starts[b+1]-1` in the sorted data.
+        Unless the data is sorted already, the order statistics are found with `np.partition`.
+
+        Parameters
+        ----------
+        S_t: np.ndarray
+            Data of one timestep
+        starts: array-like
+            Rank of the smallest element of every bin, starting with 0
+        is_sorted: bool
+            Whether `S_t` is sorted already
+
+        Returns
+        -------
+        dict
+            with the keys `lo, hi, mean, median, count`, one value per bin
+        """
+        n = len(S_t)
+        # empty bins are dropped
+        starts = np.unique(np.asarray(starts, dtype=np.int64))
+        starts = starts[starts < n]
+        ends = np.append(starts[1:], n)
+        count = ends-starts
+        mid_lo, mid_hi = starts+(count-1)//2, starts+count//2
+        if is_sorted:
+            part = S_t
+        else:
+            part = np.partition(S_t, np.unique(np.concatenate([starts, ends-1, mid_lo, mid_hi])))
+        return {
+            "lo": part[starts],
+            "hi": part[ends-1],
+            "mean": np.add.reduceat(part, starts)/count,
+            "median": (part[mid_lo]+part[mid_hi])/2,
+            "count": count}
+
+    def __getitem__(self, key):
+        return TimestepBins(self, int(key[1:]))
+
+    def __iter__(self):
+        return (f"t{i}" for i in range(len(self.count)))
+
+    def __len__(self):
+        return len(self.count)
+
+    def __repr__(self):
+        return f"Bins(timesteps={self.count.shape[0]}, nbins={self.count.shape[1]})"
+
+class TimestepBins(Mapping):
+    """
+    Dict-style view `bin{idx}: [...]` of the bins of one timestep of a `Bins` object
+    """
+
+    def __init__(self, bins, t):
+        self.bins = bins
+        self.t = t
+
+    def __getitem__(self, key):
+        b = int(key[3:])
+        if self.bins.count[self.t, b] == 0:
+            raise KeyError(key)
+        lo, hi = self.bins.lo[self.t, b], self.bins.hi[self.t, b]
+        if self.bins.data is None:
+            return np.array([lo, hi])
+        S_t = self.bins.data[self.t]
+        return S_t[(S_t >= lo) & (S_t <= hi)]
+
+    def __iter__(self):
+        return (f"bin{b}" for b in np.flatnonzero(self.bins.count[self.t] > 0))
+
+    def __len__(self):
+        return int(np.sum(self.bins.count[self.t] > 0))
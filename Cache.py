@@ -0,0 +1,179 @@
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+
+_default = None
+
+class Cache():
+    """
+    Content-addressed on-disk cache for numpy arrays
+
+    Entries are stored as `.npy` (single arrays, can be memory-mapped on load) or `.npz`
+    (groups of arrays) files named by a hash of the parameters they were computed from.
+    If the total size exceeds `max_bytes`, the least recently used entries are removed, entries
+    larger than `max_bytes` are not stored at all. The directory is created by the first store.
+    Several threads or processes may share a directory, entries removed by another one are misses.
+
+    Parameters
+    ----------
+    path: string, optional
+        Cache directory, defaults to `$BINNING_CACHE_DIR` or `~/.cache/binning`
+    max_bytes: int
+        Size limit of the cache directory
+
+    Attributes
+    ----------
+    hits, misses: int
+        Number of successful and failed lookups
+    """
+
+    def __init__(self, path=None, max_bytes=2**30):
+        if path is None:
+            path = os.environ.get("BINNING_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "binning"))
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def default():
+        """
+        Cache shared by all objects created with `cache=True`, created on first use
+        """
+        global _default
+        if _default is None:
+            _default = Cache()
+        return _default
+
+    @staticmethod
+    def key(kind, **params):
+        """
+        Hash of the kind of an artifact and the parameters it was computed from
+
+        Parameters
+        ----------
+        kind: string
+            e.g. "paths", "bins"
+        **params:
+            JSON serializable parameters
+
+        Returns
+        -------
+        string
+        """
+        text = json.dumps({"kind": kind, **params}, sort_keys=True, default=str)
+        return f"{kind}-{hashlib.sha256(text.encode()).hexdigest()[:32]}"
+
+    def _file(self, key, ext):
+        return os.path.join(self.path, key + ext)
+
+    def _read(self, file, load):
+        try:
+            # the modification time is used as last access time for the eviction
+            os.utime(file)
+            res = load(file)
+        except FileNotFoundError:
+            # never stored or removed by another process meanwhile
+            self.misses += 1
+            return None
+        self.hits += 1
+        return res
+
+    def _write(self, file, save, nbytes):
+        if nbytes > self.max_bytes:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                save(f)
+            os.replace(tmp, file)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self.evict()
+
+    def get_array(self, key, mmap_mode=None):
+        """
+        Load a single array, None if it is not cached
+
+        Parameters
+        ----------
+        key: string
+        mmap_mode: {None, "r", "r+", "c"}
+            Passed to `np.load`
+        """
+        return self._read(self._file(key, ".npy"), lambda file: np.load(file, mmap_mode=mmap_mode))
+
+    def put_array(self, key, array):
+        """
+        Store a single array
+        """
+        self._write(self._file(key, ".npy"), lambda f: np.save(f, array), np.asarray(array).nbytes)
+
+    def get(self, key):
+        """
+        Load a group of arrays as dict, None if it is not cached
+        """
+        def load(file):
+            with np.load(file) as npz:
+                return dict(npz)
+        return self._read(self._file(key, ".npz"), load)
+
+    def put(self, key, **arrays):
+        """
+        Store a group of arrays
+        """
+        self._write(self._file(key, ".npz"), lambda f: np.savez(f, **arrays),
+            sum(np.asarray(a).nbytes for a in arrays.values()))
+
+    def entries(self):
+        """
+        Cached files as list of `(path, size, last access)`, least recently used first
+        """
+        res = []
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return res
+        for name in names:
+            if name.endswith((".npy", ".npz")):
+                try:
+                    stat = os.stat(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    continue
+                res.append((os.path.join(self.path, name), stat.st_size, stat.st_mtime))
+        return sorted(res, key=lambda x: x[2])
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits into `max_bytes`
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for file, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(file)
+            total -= size
+
+    @staticmethod
+    def _remove(file):
+        try:
+            os.remove(file)
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        """
+        Remove all entries and reset the counters
+        """
+        for file, _, _ in self.entries():
+            self._remove(file)
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f"Cache(path={self.path!r}, entries={len(self.entries())}, hits={self.hits}, misses={self.misses})"
@@ -0,0 +1,173 @@
+import numpy as np
+import pandas as pd
+from Simulation import Simulation
+from Lattice import Lattice
+from Scenarios import Scenarios
+from Instrumentation import Callback
+
+class Greeks():
+    """
+    Sensitivities of tree prices by finite differences with common random numbers
+
+    All bumped scenarios reuse the standard normals of one `Simulation`: under geometric brownian
+    motion the normals can be recovered from the paths, a bump of `S0` is a rescaling of the
+    paths and a bump of `sigma` or `r` changes the drift and the scale of the log increments.
+    At every timestep the bumped paths are an increasing function of the log prices, so all
+    scenarios have the same order of the paths: with "fixed" binning the bins and transition
+    counts are computed once and shared by all scenarios (see `Scenarios.binning_shared`), only
+    the means of the bins differ. The lattices of all scenarios are stacked into one block
+    diagonal lattice, which is priced by a single backward induction.
+
+    Standard errors are estimated by batch means: the paths are split into `batches` groups,
+    the Greeks are computed on every group and the standard deviation of the group estimates
+    is divided by `sqrt(batches)`.
+
+    Parameters
+    ----------
+    S: Simulation
+        Simulation created by `generate`
+    nbins: int
+        Number of bins per timestep
+    method: {"fixed", "kmeans", "kmeans1d", "kmeans_warm"}
+        Binning method
+    batches: int
+        Number of groups of paths for the standard errors, 0 to skip them
+    dS: float, optional
+        Bump of `S0`, defaults to 1% of `S0`
+    dsigma, dr: float
+        Bumps of `sigma` and `r`
+    """
+
+    # (S0, sigma, r) bump of every scenario in units of (dS, dsigma, dr)
+    scenarios = [(0, 0, 0), (1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, -1, 0), (0, 0, 1), (0, 0, -1)]
+
+    def __init__(self, S, nbins=4, method="fixed", batches=10, dS=None, dsigma=0.01, dr=0.001):
+        if S.params is None or S.data is None:
+            raise ValueError("Greeks need a Simulation created by `generate`")
+        self.S = S
+        self.nbins = nbins
+        self.method = method
+        self.batches = batches
+        p = S.params
+        self.dS = 0.01*p["S0"] if dS is None else dS
+        self.dsigma = dsigma
+        self.dr = dr
+        self.lattice = None
+        self.roots = None
+
+    def bump(self, data, dS=0.0, dsigma=0.0, dr=0.0):
+        """
+        Paths of the simulation with bumped parameters and the same standard normals
+
+        Parameters
+        ----------
+        data: np.ndarray
+            Paths of shape `(M+1, I)` generated with the parameters of the simulation
+        dS, dsigma, dr: float
+            Absolute bumps of `S0`, `sigma` and `r`
+
+        Returns
+        -------
+        np.ndarray
+        """
+        p = self.S.params
+        dt = p["T"]/p["M"]
+        sigma, r = p["sigma"]+dsigma, p["r"]+dr
+        # sigma*sqrt(dt)*z of every step
+        noise = np.diff(np.log(data), axis=0) - (p["r"]-0.5*p["sigma"]**2)*dt
+        res = np.empty_like(data)
+        res[0] = p["S0"]+dS
+        res[1:] = (p["S0"]+dS)*np.exp(np.cumsum((r-0.5*sigma**2)*dt + sigma/p["sigma"]*noise, axis=0))
+        return res
+
+    def build(self):
+        """
+        Build the stacked lattice of all scenarios of the full simulation and of every batch
+
+        Returns
+        -------
+        Greeks
+        """
+        data = np.asarray(self.S.data)
+        groups = [data] + ([] if self.batches < 2 else np.array_split(data, self.batches, axis=1))
+        lattices, roots = zip(*[self.build_group(group) for group in groups])
+        self.lattice, self.roots = Lattice.stack(lattices, roots)
+        return self
+
+    def build_group(self, group):
+        """
+        Lattice of all scenarios of a group of paths
+
+        Parameters
+        ----------
+        group: np.ndarray
+            Paths of shape `(M+1, n)`
+
+        Returns
+        -------
+        tuple
+            `(lattice, roots)` with the block diagonal Lattice of the scenarios and the id of the
+            root of every scenario in it
+        """
+        p = self.S.params
+        bumps = np.array(self.scenarios)*[self.dS, self.dsigma, self.dr]
+        if self.method in ["fixed", "kmeans1d"]:
+            sc = Scenarios(p["S0"]+bumps[:, 0], p["T"], p["r"]+bumps[:, 2], p["sigma"]+bumps[:, 1], M=p["M"], I=group.shape[1])
+            sc.data = np.stack([self.bump(group, dS, dsigma, dr) for dS, dsigma, dr in bumps])
+            if (sc.params["sigma"] > 0).all():
+                # the log prices order the paths of every scenario like the brownian motion
+                sc.W = np.log(group)
+                sc.order = np.argsort(sc.W, axis=1, kind="stable")
+            sc.binning(nbins=self.nbins, method=self.method).build_lattice()
+            return sc.lattice, sc.roots
+
+        lattices = []
+        for dS, dsigma, dr in bumps:
+            sim = Simulation(cache=False, callback=Callback())
+            sim.data = self.bump(group, dS, dsigma, dr)
+            sim.binning(nbins=self.nbins, method=self.method).create_edgelist()
+            lattices.append(Lattice.from_edgelist(sim.edgelist))
+        return Lattice.stack(lattices)
+
+    def calc(self, strike, type="call", opt="european", discount=None):
+        """
+        Price and Greeks of an option
+
+        Parameters
+        ----------
+        strike: float
+            Strike price of the option
+        type: {"call", "put"}
+        opt: {"european", "american"}
+        discount: float, optional
+            Discount factor for one timestep. By default `exp(-r*T/M)` of every scenario, so that
+            rho includes the effect of `r` on discounting. A given discount factor is used for all
+            scenarios.
+
+        Returns
+        -------
+        pd.DataFrame
+            with the index `price, delta, gamma, vega, rho` and the columns `value, stderr`
+        """
+        if self.lattice is None:
+            self.build()
+        p = self.S.params
+        n = len(self.scenarios)
+        if discount is None:
+            discount = np.exp(-(p["r"] + self.dr*np.array([r for *_, r in self.scenarios]))*p["T"]/p["M"])
+        discount = np.broadcast_to(np.asarray(discount, dtype=float), (n,))
+
+        # one contract per scenario, every scenario is read from its own column
+        ev = self.lattice.backward_induction(strike, discount, type, opt, all_nodes=False)
+        v = ev[self.roots, np.tile(np.arange(n), len(self.roots)//n)].reshape(-1, n)
+        estimates = np.column_stack([
+            v[:, 0],
+            (v[:, 1]-v[:, 2])/(2*self.dS),
+            (v[:, 1]-2*v[:, 0]+v[:, 2])/self.dS**2,
+            (v[:, 3]-v[:, 4])/(2*self.dsigma),
+            (v[:, 5]-v[:, 6])/(2*self.dr)])
+
+        stderr = np.full(5, np.nan)
+        if len(estimates) > 2:
+            stderr = estimates[1:].std(axis=0, ddof=1)/np.sqrt(len(estimates)-1)
+        return pd.DataFrame({"value": estimates[0], "stderr": stderr}, index=["price", "delta", "gamma", "vega", "rho"])
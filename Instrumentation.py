@@ -0,0 +1,247 @@
+import io
+import sys
+import time
+import logging
+import cProfile
+import pstats
+import functools
+import tracemalloc
+
+class Callback():
+    """
+    Receiver of the progress and metrics of the stages of the pipeline
+
+    The base class ignores everything, subclasses override the methods they need. Every stage
+    calls `on_start` once, `on_update` for processed items of stages which report progress, with
+    the `total` number of items, and `on_end` with the metrics of the stage.
+
+    Attributes
+    ----------
+    profile: bool
+        Whether the stages are run under `cProfile`, the statistics are passed as `profile` metric
+    trace_memory: bool
+        Whether the peak memory of the stages is traced by `tracemalloc`, passed as `peak_bytes` metric
+    """
+
+    profile = False
+    trace_memory = False
+
+    def on_start(self, stage):
+        pass
+
+    def on_update(self, stage, n=1, total=None):
+        pass
+
+    def on_end(self, stage, metrics):
+        """
+        Parameters
+        ----------
+        stage: string
+            e.g. "generate", "binning"
+        metrics: dict
+            `seconds` and, if known, `items` (paths, bins, edges or nodes), `nbytes` (size of the
+            result), `peak_bytes` and `profile` (`pstats.Stats`)
+        """
+        pass
+
+class Callbacks(Callback):
+    """
+    Forward the events to several callbacks, profiling and memory tracing are switched on if any of
+    them needs it
+    """
+
+    def __init__(self, *callbacks):
+        self.callbacks = list(callbacks)
+        self.profile = any(c.profile for c in self.callbacks)
+        self.trace_memory = any(c.trace_memory for c in self.callbacks)
+
+    def on_start(self, stage):
+        for c in self.callbacks:
+            c.on_start(stage)
+
+    def on_update(self, stage, n=1, total=None):
+        for c in self.callbacks:
+            c.on_update(stage, n, total)
+
+    def on_end(self, stage, metrics):
+        for c in self.callbacks:
+            c.on_end(stage, metrics)
+
+class TqdmCallback(Callback):
+    """
+    Progress bars for the stages reporting progress
+
+    Parameters
+    ----------
+    stages: iterable, optional
+        Stages to show, all if None
+    """
+
+    def __init__(self, stages=None):
+        self.stages = None if stages is None else set(stages)
+        self.bars = {}
+
+    def on_update(self, stage, n=1, total=None):
+        if self.stages is not None and stage not in self.stages:
+            return
+        if stage not in self.bars:
+            from tqdm import tqdm
+            self.bars[stage] = tqdm(total=total, desc=stage)
+        self.bars[stage].update(n)
+
+    def on_end(self, stage, metrics):
+        bar = self.bars.pop(stage, None)
+        if bar is not None:
+            bar.close()
+
+    def __getstate__(self):
+        # open progress bars are not sent to worker processes
+        return {"stages": self.stages, "bars": {}}
+
+class LoggingCallback(Callback):
+    """
+    Log one line with the metrics of every stage
+
+    Parameters
+    ----------
+    logger: logging.Logger, optional
+        defaults to the logger `binning`
+    level: int
+    """
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logging.getLogger("binning") if logger is None else logger
+        self.level = level
+
+    def on_end(self, stage, metrics):
+        text = " ".join(f"{k}={v:.4g}" if isinstance(v, float) else f"{k}={v}"
+            for k, v in metrics.items() if k != "profile")
+        self.logger.log(self.level, f"{stage}: {text}")
+
+class TimerCallback(Callback):
+    """
+    Collect the metrics of all stages in memory
+
+    Parameters
+    ----------
+    profile, trace_memory: bool
+        see `Callback`
+
+    Attributes
+    ----------
+    records: list
+        dicts with the key `stage` and the metrics of every finished stage
+    """
+
+    def __init__(self, profile=False, trace_memory=False):
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.records = []
+
+    def on_end(self, stage, metrics):
+        self.records.append({"stage": stage, **metrics})
+
+    def frame(self):
+        """
+        Metrics as pd.DataFrame, one row per stage, without the profiles
+        """
+        import pandas as pd
+        return pd.DataFrame([{k: v for k, v in r.items() if k != "profile"} for r in self.records])
+
+    def print_profile(self, stage, n=20, sort="cumulative"):
+        """
+        Print the `n` most expensive functions of the last profiled run of `stage`
+        """
+        stats = [r["profile"] for r in self.records if r["stage"] == stage and "profile" in r]
+        if not stats:
+            raise ValueError(f"no profile of {stage}, use profile=True")
+        stats[-1].stream = sys.stdout
+        stats[-1].sort_stats(sort).print_stats(n)
+
+class Stage():
+    """
+    Context manager measuring one stage for a callback, see `instrument`
+    """
+
+    # only the outermost stage is profiled, cProfile can not be nested
+    profiling = False
+
+    def __init__(self, callback, name):
+        self.callback = callback
+        self.name = name
+        self.metrics = {}
+
+    def __enter__(self):
+        self.profiler = None
+        if self.callback.profile and not Stage.profiling:
+            Stage.profiling = True
+            self.profiler = cProfile.Profile()
+        self.tracing = self.callback.trace_memory and not tracemalloc.is_tracing()
+        if self.callback.trace_memory:
+            if self.tracing:
+                tracemalloc.start()
+            self.memory_start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self.callback.on_start(self.name)
+        self.start = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.enable()
+        return self
+
+    def progress(self, iterable, total):
+        """
+        Yield the items of `iterable` and report every item as progress
+        """
+        for item in iterable:
+            yield item
+            self.callback.on_update(self.name, 1, total)
+
+    def __exit__(self, *exc):
+        if self.profiler is not None:
+            self.profiler.disable()
+            Stage.profiling = False
+        metrics = {"seconds": time.perf_counter()-self.start, **self.metrics}
+        if self.callback.trace_memory:
+            metrics["peak_bytes"] = tracemalloc.get_traced_memory()[1] - self.memory_start
+            if self.tracing:
+                tracemalloc.stop()
+        if self.profiler is not None:
+            metrics["profile"] = pstats.Stats(self.profiler, stream=io.StringIO())
+        if exc[0] is None:
+            self.callback.on_end(self.name, metrics)
+        else:
+            self.callback.on_end(self.name, {**metrics, "error": exc[0].__name__})
+        return False
+
+def instrument(stage, items=None, nbytes=None):
+    """
+    Decorator measuring a method as stage of its object's `callback`
+
+    The decorated method takes an additional keyword argument `callback`, which replaces the
+    object's callback for this call, e.g. to profile a single call. While the method runs, the
+    stage is available as `self.stage` for progress updates.
+
+    Parameters
+    ----------
+    stage: string
+        Name of the stage
+    items, nbytes: callable, optional
+        Functions of the object computing the `items` and `nbytes` metrics after the call
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, callback=None, **kwargs):
+            callback = callback or getattr(self, "callback", None) or Callback()
+            outer = getattr(self, "stage", None)
+            with Stage(callback, stage) as s:
+                self.stage = s
+                try:
+                    res = func(self, *args, **kwargs)
+                finally:
+                    self.stage = outer
+                for key, f in [("items", items), ("nbytes", nbytes)]:
+                    if f is not None:
+                        s.metrics[key] = f(self)
+            return res
+        return wrapper
+    return decorator
@@ -0,0 +1,394 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+class Lattice():
+    """
+    Compact array representation of a tree
+
+    Nodes are identified by integer ids which are ordered by timestep, the nodes of timestep `t`
+    have the ids `offsets[t]:offsets[t+1]`. The transition probabilities between two consecutive
+    timesteps are stored as sparse CSR matrix of shape `(n_t, n_t+1)`.
+
+    Attributes
+    ----------
+    names: np.ndarray
+        Name of every node
+    values: np.ndarray
+        Value of every node
+    t: np.ndarray
+        Timestep of every node
+    offsets: np.ndarray
+        Start id of the nodes of every timestep, has length `n_timesteps+1`
+    transitions: list
+        `scipy.sparse.csr_matrix` for every pair of consecutive timesteps
+    """
+
+    def __init__(self, names, values, t, transitions):
+        self.names = np.asarray(names)
+        self.values = np.asarray(values, dtype=float)
+        self.t = np.asarray(t, dtype=np.int64)
+        self.offsets = np.searchsorted(self.t, np.arange(self.t.max()+2))
+        self.transitions = transitions
+        self.index = pd.Index(self.names)
+
+    @classmethod
+    def from_edges(cls, parent, child, par_value, ch_value, prob, t_p=None):
+        """
+        Create a Lattice from the columns of an edgelist
+
+        Parameters
+        ----------
+        parent, child: array-like
+            Names of the parent and child node of every edge
+        par_value, ch_value: array-like
+            Values of the parent and child node of every edge
+        prob: array-like
+            Transition probability of every edge
+        t_p: array-like, optional
+            Timestep of the parent node of every edge. If not given, the timesteps are derived from
+            the structure of the tree, nodes without parents are at timestep 0.
+
+        Returns
+        -------
+        Lattice
+        """
+        n_edges = len(parent)
+        codes, names = pd.factorize(np.concatenate([np.asarray(parent, dtype=object), np.asarray(child, dtype=object)]))
+        p, c = codes[:n_edges], codes[n_edges:]
+
+        values = np.empty(len(names))
+        values[p] = par_value
+        values[c] = ch_value
+
+        if t_p is None:
+            t = cls.levels(p, c, len(names))
+        else:
+            t = np.empty(len(names), dtype=np.int64)
+            t[p] = t_p
+            t[c] = np.asarray(t_p) + 1
+        if np.any(t[c] != t[p]+1):
+            raise ValueError("edges have to connect nodes of consecutive timesteps")
+
+        # new ids ordered by timestep, keeping the order of appearance within a timestep
+        order = np.lexsort((np.arange(len(names)), t))
+        new_id = np.empty_like(order)
+        new_id[order] = np.arange(len(order))
+        p, c = new_id[p], new_id[c]
+        names, values, t = np.asarray(names, dtype=object)[order], values[order], t[order]
+        offsets = np.searchsorted(t, np.arange(t.max()+2))
+
+        # for duplicate edges the last one is kept
+        prob = np.asarray(prob, dtype=float)
+        pair = p.astype(np.int64)*len(names) + c
+        _, last = np.unique(pair[::-1], return_index=True)
+        last = n_edges-1-last
+        p, c, prob = p[last], c[last], prob[last]
+
+        transitions = []
+        for ts in range(len(offsets)-2):
+            mask = t[p] == ts
+            transitions.append(sparse.csr_matrix(
+                (prob[mask], (p[mask]-offsets[ts], c[mask]-offsets[ts+1])),
+                shape=(offsets[ts+1]-offsets[ts], offsets[ts+2]-offsets[ts+1])))
+
+        return cls(names, values, t, transitions)
+
+    @classmethod
+    def from_edgelist(cls, edgelist):
+        """
+        Create a Lattice from an edgelist as created by `Simulation.create_edgelist` or read from csv
+
+        Parameters
+        ----------
+        edgelist: pd.DataFrame
+            with the columns `parent, par_value, child, ch_value, prob` and optionally `position_p`
+
+        Returns
+        -------
+        Lattice
+        """
+        t_p = None
+        if "position_p" in edgelist.columns:
+            t_p = cls.timesteps(edgelist["position_p"])
+        return cls.from_edges(edgelist["parent"].to_numpy(), edgelist["child"].to_numpy(),
+            edgelist["par_value"].to_numpy(dtype=float), edgelist["ch_value"].to_numpy(dtype=float),
+            edgelist["prob"].to_numpy(dtype=float), t_p)
+
+    @staticmethod
+    def timesteps(positions):
+        """
+        Timesteps of the `position_p` column of an edgelist
+
+        The positions are tuples `(t, value)`, or their string representation like `"(0, 100.0)"`
+        in an edgelist read from csv.
+
+        Returns
+        -------
+        np.ndarray or None
+            None if a position can not be read, the timesteps are then derived from the structure
+            of the tree
+        """
+        try:
+            return np.array([pos[0] if isinstance(pos, tuple) else int(str(pos).strip("()[] ").split(",")[0])
+                for pos in positions], dtype=np.int64)
+        except (ValueError, TypeError, IndexError):
+            return None
+
+    def to_arrays(self):
+        """
+        Flat arrays describing the lattice, see `from_arrays`
+
+        Returns
+        -------
+        dict
+            with the keys `names, values, t, data, indices, indptr`, where the CSR arrays of all
+            transition matrices are concatenated
+        """
+        names = self.names
+        if names.dtype == object:
+            try:
+                names = names.astype(float)
+            except (TypeError, ValueError):
+                names = names.astype(str)
+        return {
+            "names": names,
+            "values": self.values,
+            "t": self.t,
+            "data": np.concatenate([P.data for P in self.transitions] + [np.array([])]),
+            "indices": np.concatenate([P.indices for P in self.transitions] + [np.array([], dtype=np.int32)]),
+            "indptr": np.concatenate([P.indptr for P in self.transitions] + [np.array([], dtype=np.int32)])}
+
+    @classmethod
+    def from_arrays(cls, names, values, t, data, indices, indptr):
+        """
+        Create a Lattice from the arrays of `to_arrays`
+
+        Returns
+        -------
+        Lattice
+        """
+        t = np.asarray(t)
+        offsets = np.searchsorted(t, np.arange(t.max()+2))
+        transitions = []
+        ptr_start, nnz_start = 0, 0
+        for ts in range(len(offsets)-2):
+            n_p, n_c = offsets[ts+1]-offsets[ts], offsets[ts+2]-offsets[ts+1]
+            ptr = np.asarray(indptr[ptr_start:ptr_start+n_p+1])
+            nnz = int(ptr[-1])
+            transitions.append(sparse.csr_matrix(
+                (data[nnz_start:nnz_start+nnz], indices[nnz_start:nnz_start+nnz], ptr), shape=(n_p, n_c)))
+            ptr_start += n_p+1
+            nnz_start += nnz
+        return cls(np.asarray(names, dtype=object), values, t, transitions)
+
+    @classmethod
+    def stack(cls, lattices, roots=None):
+        """
+        Combine lattices with the same number of timesteps into one block diagonal lattice
+
+        Parameters
+        ----------
+        lattices: list
+            Lattice objects
+        roots: list, optional
+            Id or array of ids of the roots in every lattice, defaults to `root` of every lattice
+
+        Returns
+        -------
+        tuple
+            `(lattice, roots)` with the stacked Lattice and the ids of the roots of all lattices in it
+        """
+        n_t = lattices[0].n_timesteps
+        if any(l.n_timesteps != n_t for l in lattices):
+            raise ValueError("lattices need the same number of timesteps")
+        ids = [np.arange(l.offsets[t], l.offsets[t+1]) for t in range(n_t) for l in lattices]
+        names = np.concatenate([l.names[i] for l, i in zip(lattices*n_t, ids)])
+        values = np.concatenate([l.values[i] for l, i in zip(lattices*n_t, ids)])
+        t = np.repeat(np.arange(n_t), [sum(len(l.nodes_at(ts)) for l in lattices) for ts in range(n_t)])
+        transitions = [sparse.block_diag([l.transitions[ts] for l in lattices], format="csr") for ts in range(n_t-1)]
+        # the nodes of timestep 0 of every lattice follow those of the previous lattices
+        start = np.cumsum([0] + [l.offsets[1] for l in lattices[:-1]])
+        roots = [l.root for l in lattices] if roots is None else roots
+        return cls(names, values, t, transitions), np.concatenate([s + np.ravel(r) for s, r in zip(start, roots)])
+
+    @staticmethod
+    def levels(p, c, n):
+        """
+        Timestep of every node given by its distance to the nodes without parents
+
+        Parameters
+        ----------
+        p, c: np.ndarray
+            Parent and child id of every edge
+        n: int
+            Number of nodes
+
+        Returns
+        -------
+        np.ndarray
+        """
+        # children of every node as CSR adjacency
+        order = np.argsort(p, kind="stable")
+        start = np.concatenate([[0], np.cumsum(np.bincount(p, minlength=n))])
+        t = np.full(n, -1, dtype=np.int64)
+        roots = np.ones(n, dtype=bool)
+        roots[c] = False
+        frontier = np.flatnonzero(roots)
+        level = 0
+        while len(frontier):
+            if level > n:
+                raise ValueError("edgelist contains a cycle")
+            t[frontier] = level
+            # edges of all nodes of the frontier
+            lengths = start[frontier+1]-start[frontier]
+            edge = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths)-lengths-start[frontier], lengths)
+            frontier = np.unique(c[order[edge]])
+            level += 1
+        if np.any(t < 0):
+            raise ValueError("edgelist contains nodes which can not be reached from a root")
+        return t
+
+    @property
+    def n_timesteps(self):
+        return len(self.offsets)-1
+
+    @property
+    def root(self):
+        """
+        Id of the root, the last node of timestep 0
+
+        A simulation starts all paths in `S0`, so its tree has a single node at timestep 0.
+        """
+        return self.offsets[1]-1
+
+    def roots(self, tree=None):
+        """
+        Id of the root of every tree of a stacked lattice, the last node of timestep 0 of the tree
+
+        Parameters
+        ----------
+        tree: array-like, optional
+            Tree of every node of timestep 0, the nodes of one tree are consecutive. A single tree
+            if None.
+
+        Returns
+        -------
+        np.ndarray
+        """
+        if tree is None:
+            return np.array([self.root])
+        tree = np.asarray(tree)
+        return np.flatnonzero(np.append(tree[1:] != tree[:-1], True))
+
+    def nodes_at(self, t):
+        """
+        Ids of the nodes of timestep `t`
+        """
+        return np.arange(self.offsets[t], self.offsets[t+1])
+
+    def n_children(self):
+        """
+        Number of children of every node
+        """
+        res = np.zeros(len(self.names), dtype=np.int64)
+        for t, P in enumerate(self.transitions):
+            res[self.offsets[t]:self.offsets[t+1]] = np.diff(P.indptr)
+        return res
+
+    def children(self, i):
+        """
+        Children of node `i` as dict of the form `{child_id: probability}`
+        """
+        t = self.t[i]
+        if t >= len(self.transitions):
+            return {}
+        row = self.transitions[t].getrow(i-self.offsets[t])
+        return dict(zip((row.indices+self.offsets[t+1]).tolist(), row.data.tolist()))
+
+    def parents(self, i):
+        """
+        Parents of node `i` as dict of the form `{parent_id: probability}`
+        """
+        t = self.t[i]
+        if t == 0:
+            return {}
+        col = self.transitions[t-1].getcol(i-self.offsets[t]).tocoo()
+        return dict(zip((col.row+self.offsets[t-1]).tolist(), col.data.tolist()))
+
+    @staticmethod
+    def contracts(strike, discount, type="call", opt="european"):
+        """
+        Contracts of broadcast option parameters
+
+        Parameters
+        ----------
+        strike: float or array-like
+        discount: float or array-like
+        type: {"call", "put"} or array-like
+            also "c" and "p"
+        opt: {"european", "american"} or array-like
+
+        Returns
+        -------
+        list
+            `[strike, discount, type, opt]` broadcast against each other and raveled, one element
+            per contract
+        """
+        strike, discount, type, opt = [np.ravel(a) for a in
+            np.broadcast_arrays(np.asarray(strike, dtype=float), np.asarray(discount, dtype=float),
+                np.asarray(type, dtype=object), np.asarray(opt, dtype=object))]
+        for name, values, allowed in [("option type", type, ["c", "call", "p", "put"]),
+                ("option", opt, ["european", "american"])]:
+            unknown = ~np.isin(values, allowed)
+            if unknown.any():
+                raise ValueError(f"unknown {name} {values[unknown][0]}")
+        return [strike, discount, type, opt]
+
+    def backward_induction(self, strike, discount, type="call", opt="european", all_nodes=True):
+        """
+        Option values by backward induction through the lattice
+
+        All arguments are broadcast against each other, every resulting element describes one
+        contract. The contracts are priced together, every timestep is a single sparse
+        matrix-matrix product of the transition matrix with the `(nodes x contracts)` values.
+
+        Parameters
+        ----------
+        strike: float or array-like
+            Strike price of the option
+        discount: float or array-like
+            Discount factor for one timestep
+        type: {"call", "put"} or array-like
+        opt: {"european", "american"} or array-like
+        all_nodes: bool
+            If False, only the values of the nodes of timestep 0 are kept and returned
+
+        Returns
+        -------
+        np.ndarray
+            Option values of shape `(nodes, contracts)`
+        """
+        strike, discount, type, opt = self.contracts(strike, discount, type, opt)
+        sign = np.where(np.isin(type, ["p", "put"]), -1.0, 1.0)
+        american = opt == "american"
+
+        def exercise(ids):
+            return sign*(self.values[ids, None]-strike)
+
+        has_children = self.n_children() > 0
+        last = self.n_timesteps-1
+        ids = slice(self.offsets[last], self.offsets[last+1])
+        ev_t = np.maximum(0.0, exercise(ids))
+        res = [ev_t]
+        for t in range(last-1, -1, -1):
+            ids = slice(self.offsets[t], self.offsets[t+1])
+            ex = exercise(ids)
+            s = discount*(self.transitions[t] @ ev_t)
+            s = np.where(american, np.maximum(s, ex), s)
+            ev_t = np.where(has_children[ids, None], s, np.maximum(0.0, ex))
+            if all_nodes:
+                res.append(ev_t)
+        if not all_nodes:
+            return ev_t
+        return np.concatenate(res[::-1])
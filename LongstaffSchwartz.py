@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+from Lattice import Lattice
+from Instrumentation import Callback, instrument
+
+class LongstaffSchwartz():
+    """
+    Option prices by least squares Monte Carlo directly on the paths of a simulation
+
+    No bins or lattice are built. The cash flows of every path are discounted backwards; for
+    american options the continuation value at every timestep is estimated by a least squares
+    regression of the discounted cash flows of the in the money paths on polynomials of the
+    standardized price, and a path exercises where the payoff exceeds the estimate.
+
+    All contracts are priced together: the regression of every timestep is solved for all
+    contracts at once by the normal equations of the in the money paths of every contract.
+
+    Parameters
+    ----------
+    S: Simulation
+        Simulation with `data` of shape `(M+1, I)`
+    degree: int
+        Degree of the polynomial basis
+    callback: Callback, optional
+        Receives the metrics of `calc_option_value`, see `Instrumentation`
+    """
+
+    def __init__(self, S, degree=3, callback=None):
+        if S.data is None:
+            raise ValueError("LongstaffSchwartz needs a Simulation with paths, e.g. by `generate`")
+        self.S = S
+        self.degree = degree
+        self.callback = Callback() if callback is None else callback
+        self.option_params = None
+        self.option_price = None
+        self.stderr = None
+
+    def cash_flows(self, strike, discount, type="call", opt="european"):
+        """
+        Discounted cash flows of every path at timestep 0
+
+        Parameters
+        ----------
+        strike: float or array-like
+            Strike prices of the options
+        discount: float or array-like
+            Discount factor for one timestep
+        type: {"call", "put"} or array-like
+        opt: {"european", "american"} or array-like
+
+        Returns
+        -------
+        np.ndarray
+            Cash flows of shape `(I, contracts)`
+        """
+        strike, discount, type, opt = Lattice.contracts(strike, discount, type, opt)
+        sign = np.where(np.isin(type, ["p", "put"]), -1.0, 1.0)
+        american = opt == "american"
+
+        data = np.asarray(self.S.data)
+        last = len(data)-1
+        V = np.maximum(0.0, sign*(data[last, :, None]-strike))
+        for t in range(last-1, -1, -1):
+            V *= discount
+            if not american.any():
+                continue
+            ex = sign*(data[t, :, None]-strike)
+            if t == 0:
+                # all paths start in S0, exercise if it beats the mean of the continuation
+                cont = V.mean(axis=0)
+                V = np.where(american & (ex > cont), ex, V)
+                continue
+            itm = (ex > 0) & american
+            x = data[t]
+            x = (x-x.mean())/(x.std() or 1.0)
+            X = np.vander(x, self.degree+1, increasing=True)
+            # normal equations of the in the money paths of every contract
+            A = np.einsum("ic,ij,ik->cjk", itm, X, X, optimize=True)
+            b = np.einsum("ic,ij,ic->cj", itm, X, V, optimize=True)
+            beta = np.einsum("cjk,ck->cj", np.linalg.pinv(A), b)
+            cont = X @ beta.T
+            V = np.where(itm & (ex > cont), ex, V)
+        return V
+
+    @instrument("calc_option_value", items=lambda self: np.shape(self.S.data)[1])
+    def calc_option_value(self, strike, discount, type="call", opt="european"):
+        """
+        Calculation of the price of an option, same interface as `Tree.calc_option_value`
+
+        Parameters
+        ----------
+        self: LongstaffSchwartz Object
+        strike: float
+            Strike price of the option
+        discount: float
+            discount factor for one timestep
+        type: {"call", "put"}
+        opt: {"european", "american"}
+        """
+        self.option_params = {"Strike Price": strike, "Discount Rate": discount, "Type": type, "Option": opt}
+        V = self.cash_flows(strike, discount, type, opt)[:, 0]
+        self.option_price = V.mean()
+        self.stderr = V.std(ddof=1)/np.sqrt(len(V))
+        return self
+
+    def calc_option_values(self, strike, discount, type="call", opt="european"):
+        """
+        Calculation of the option prices of many contracts, see `Tree.calc_option_values`
+
+        Returns
+        -------
+        pd.DataFrame
+            with the columns `strike, discount, type, opt, price, stderr`, one row per contract
+        """
+        strike, discount, type, opt = Lattice.contracts(strike, discount, type, opt)
+        V = self.cash_flows(strike, discount, type, opt)
+        return pd.DataFrame({"strike": strike, "discount": discount, "type": type, "opt": opt,
+            "price": V.mean(axis=0), "stderr": V.std(axis=0, ddof=1)/np.sqrt(len(V))})
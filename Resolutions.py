@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+from Simulation import Simulation, kmeans_1d
+from Lattice import Lattice
+from Bins import Bins
+from Instrumentation import Callback
+
+class Resolutions():
+    """
+    Trees of one simulation for many numbers of bins
+
+    Every timestep is sorted once. The rank of every path in its timestep is its finest bin, the
+    bins of every number of bins are ranges of ranks, so the bins of a path follow from its rank
+    without sorting or partitioning again. With "fixed" the ranges are the equal count chunks of
+    `binning_t_fs`, with "kmeans1d" the independently optimal clusters of `kmeans_1d` on the
+    sorted timestep. The edgelists are the same as those of `binning(nbins=k, method=method)`
+    followed by `create_edgelist()` up to the rounding of the bin statistics. The lattices are
+    built from the arrays of the edges, the edgelist DataFrames only on request by `edgelist`.
+
+    The lattices of all numbers of bins are stacked into one block diagonal lattice (see
+    `Lattice.stack`), which prices all of them by a single backward induction.
+
+    Parameters
+    ----------
+    S: Simulation
+        Simulation with `data` of shape `(M+1, I)`
+    nbins: iterable
+        Numbers of bins per timestep
+    method: {"fixed", "kmeans1d"}
+        Binning method
+    statistic: {"mean", "median"}
+        Statistic representing the bins, see `create_edgelist`
+    """
+
+    def __init__(self, S, nbins=range(2, 65), method="fixed", statistic="mean"):
+        if S.data is None:
+            raise ValueError("Resolutions need a Simulation with paths, e.g. by `generate`")
+        if method not in ["fixed", "kmeans1d"]:
+            raise ValueError(f"unknown binning method {method}")
+        if statistic not in ["mean", "median"]:
+            raise ValueError(f"unknown statistic {statistic}")
+        self.S = S
+        self.nbins = list(nbins)
+        self.method = method
+        self.statistic = statistic
+        self.bins = {}
+        # (values_p, values_c, pairs, prob) of every pair of timesteps, see `Simulation.merge_nodes`
+        self.edges = {}
+        self.lattice = None
+        self.roots = None
+
+    def starts(self, sorted, n):
+        """
+        Rank of the smallest element of every bin of a sorted timestep
+        """
+        if self.method == "kmeans1d":
+            return kmeans_1d(sorted, n)
+        k, m = divmod(len(sorted), n)
+        return [i*k+min(i, m) for i in range(n)]
+
+    def build(self):
+        """
+        Bins, edgelist and lattice of every number of bins and the stacked lattice of all of them
+
+        Returns
+        -------
+        Resolutions
+        """
+        data = np.asarray(self.S.data)
+        M, I = data.shape[0]-1, data.shape[1]
+        order = np.argsort(data, axis=1, kind="stable")
+        sorted = np.take_along_axis(data, order, axis=1)
+        rank = np.empty_like(order)
+        np.put_along_axis(rank, order, np.arange(I)[None, :], axis=1)
+
+        lattices = []
+        for n in self.nbins:
+            bins = Bins.from_timesteps([Bins.summarize(sorted[i], self.starts(sorted[i], n), is_sorted=True)
+                for i in range(M+1)])
+            sim = Simulation(cache=False, callback=Callback())
+            sim.bin_data = bins
+            sim.reset_transitions(M, bins.count.shape[1])
+            for i in range(M+1):
+                # bin of every rank, compared by value like `assign_bins` so that ties share a bin
+                hi = bins.hi[i][bins.count[i] > 0]
+                codes = np.searchsorted(hi, sorted[i], side="left")[rank[i]]
+                if i > 0:
+                    sim.count_transitions(i-1, codes_p, codes)
+                codes_p = codes
+            rep = getattr(bins, self.statistic)
+            self.bins[n] = bins
+            self.edges[n] = [sim.merge_nodes(i, rep)[:4] for i in range(M)]
+            parent = np.concatenate([v_p[pairs // len(v_c)] for v_p, v_c, pairs, _ in self.edges[n]])
+            child = np.concatenate([v_c[pairs % len(v_c)] for _, v_c, pairs, _ in self.edges[n]])
+            t = np.repeat(np.arange(M), [len(pairs) for _, _, pairs, _ in self.edges[n]])
+            lattices.append(Lattice.from_edges(parent, child, parent, child,
+                np.concatenate([prob for *_, prob in self.edges[n]]), t))
+        self.lattice, self.roots = Lattice.stack(lattices)
+        return self
+
+    def edgelist(self, n):
+        """
+        Edgelist of `n` bins like `Simulation.create_edgelist`
+
+        Returns
+        -------
+        pd.DataFrame
+        """
+        if self.lattice is None:
+            self.build()
+        return Simulation(cache=False, callback=Callback()).build_edgelist(self.edges[n])
+
+    def calc(self, strike, discount=None, type="call", opt="european"):
+        """
+        Prices of options on the trees of all numbers of bins
+
+        Parameters
+        ----------
+        strike: float or array-like
+            Strike prices of the options
+        discount: float or array-like, optional
+            Discount factor for one timestep, defaults to `exp(-r*T/M)` of the simulation
+        type: {"call", "put"} or array-like
+        opt: {"european", "american"} or array-like
+
+        Returns
+        -------
+        pd.DataFrame
+            with the columns `nbins, strike, discount, type, opt, price`, one row per number of
+            bins and contract
+        """
+        if self.lattice is None:
+            self.build()
+        if discount is None:
+            p = self.S.params
+            if p is None:
+                raise ValueError("discount is needed for a Simulation not created by `generate`")
+            discount = np.exp(-p["r"]*p["T"]/p["M"])
+        strike, discount, type, opt = Lattice.contracts(strike, discount, type, opt)
+        ev = self.lattice.backward_induction(strike, discount, type, opt, all_nodes=False)
+        n_k, n_c = len(self.nbins), len(strike)
+        return pd.DataFrame({"nbins": np.repeat(self.nbins, n_c), "strike": np.tile(strike, n_k),
+            "discount": np.tile(discount, n_k), "type": np.tile(type, n_k), "opt": np.tile(opt, n_k),
+            "price": ev[self.roots].ravel()})
@@ -0,0 +1,270 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from Simulation import kmeans_1d
+from Lattice import Lattice
+
+class Scenarios():
+    """
+    Simulation, binning and pricing of a grid of parameter scenarios in one vectorized pass
+
+    The parameters are broadcast against each other, every element is one scenario. All
+    scenarios share the standard normals (common random numbers), the paths are stored as
+    tensor of shape `(scenarios, M+1, I)`. Scenario `s` has the same paths as
+    `Simulation().generate(..., seed=seed)` with its parameters.
+
+    The lattices of all scenarios are built directly from the transition counts into one block
+    diagonal `Lattice`, ordered by timestep like every lattice, which is priced by a single
+    backward induction.
+
+    Parameters
+    ----------
+    S0, T, r, sigma: float or array-like
+        Parameters of the scenarios, see `Simulation.generate`
+    M: int
+        Timesteps, the same for all scenarios
+    I: int
+        Number of paths per scenario
+    seed: int
+        Seed of the standard normals
+
+    Attributes
+    ----------
+    params: pd.DataFrame
+        Parameters of every scenario, columns `S0, T, r, sigma`
+    data: np.ndarray
+        Paths of shape `(scenarios, M+1, I)`
+    W: np.ndarray
+        Brownian motion of the paths in units of `sqrt(dt)`, shape `(M+1, I)`
+    order: np.ndarray
+        Order of the paths at every timestep, shape `(M+1, I)`. With common random numbers the
+        paths of every scenario are an increasing function of `W`, so the order is the same in every
+        scenario and only has to be sorted once.
+    codes: np.ndarray
+        Bin of every path, same shape as `data`. A read-only broadcast view if the bins are the same
+        in all scenarios.
+    mean, count: np.ndarray
+        Mean and number of paths of every bin, shape `(scenarios, M+1, nbins)`
+    lattice: Lattice
+        Block diagonal lattice of all scenarios
+    roots: np.ndarray
+        Node id of the root of every scenario in `lattice`
+    node_scenario: np.ndarray
+        Scenario of every node of `lattice`
+    """
+
+    def __init__(self, S0=100., T=1.0, r=0.05, sigma=0.2, M=20, I=100, seed=0):
+        S0, T, r, sigma = [np.ravel(a) for a in np.broadcast_arrays(*[np.asarray(a, dtype=float) for a in [S0, T, r, sigma]])]
+        self.params = pd.DataFrame({"S0": S0, "T": T, "r": r, "sigma": sigma})
+        self.M = M
+        self.I = I
+        self.seed = seed
+        self.data = None
+        self.W = None
+        self.order = None
+        self.codes = None
+        self.mean = None
+        self.count = None
+        self.lattice = None
+        self.roots = None
+        self.node_scenario = None
+
+    def __len__(self):
+        return len(self.params)
+
+    def generate(self):
+        """
+        Generate the paths of all scenarios from one set of standard normals
+
+        Returns
+        -------
+        Scenarios
+        """
+        p = {c: self.params[c].to_numpy()[:, None, None] for c in self.params.columns}
+        # the normals of the first chunk of `Simulation.generate_chunk`
+        rng = np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=(0,)))
+        z = rng.standard_normal((self.M, self.I))
+        dt = p["T"]/self.M
+        self.W = np.concatenate([np.zeros((1, self.I)), np.cumsum(z, axis=0)])
+        self.order = np.argsort(self.W, axis=1, kind="stable")
+        S = np.empty((len(self), self.M+1, self.I))
+        S[:, 0] = p["S0"][:, 0]
+        np.cumsum(z*(p["sigma"]*np.sqrt(dt)) + (p["r"]-0.5*p["sigma"]**2)*dt, axis=1, out=S[:, 1:])
+        np.exp(S[:, 1:], out=S[:, 1:])
+        S[:, 1:] *= p["S0"]
+        self.data = S
+        return self
+
+    def binning(self, nbins=4, method="fixed"):
+        """
+        Assign the paths of every scenario and timestep to `nbins` bins
+
+        The paths are sorted by the common `order` (or along the path axis if the data was not
+        generated). With "fixed", the bins are given by ranks as in `Simulation.binning_t_fs` for all
+        rows at once, with "kmeans1d" the bins of every row are found by `kmeans_1d` on the sorted row.
+        Equal values are always assigned to the same bin, like `Simulation.assign_bins`.
+
+        The ranks of the "fixed" bins do not depend on the scenario, so for generated paths with
+        positive volatilities the bins are computed once from `W` and shared by all scenarios, only
+        the means are computed per scenario.
+
+        Parameters
+        ----------
+        nbins: int
+            Number of bins
+        method: {"fixed", "kmeans1d"}
+
+        Returns
+        -------
+        Scenarios
+        """
+        n_s, n_t, I = self.data.shape
+        if method == "fixed" and self.W is not None and self.W.shape == (n_t, I) and (self.params["sigma"] > 0).all():
+            return self.binning_shared(nbins)
+
+        if self.order is not None and self.order.shape == (n_t, I):
+            order = self.order[None]
+        else:
+            order = np.argsort(self.data, axis=2, kind="stable")
+        sorted = np.take_along_axis(self.data, order, axis=2)
+
+        # rank of the first element equal to every element of the sorted rows
+        first = np.where(np.diff(sorted, axis=2, prepend=-np.inf) != 0, np.arange(I), 0)
+        np.maximum.accumulate(first, axis=2, out=first)
+
+        # bin of every rank: number of starts not greater than the rank
+        if method == "fixed":
+            k, m = divmod(I, nbins)
+            sorted_codes = np.searchsorted(np.array([i*k+min(i, m) for i in range(nbins)]), first, side="right")-1
+        elif method == "kmeans1d":
+            starts = np.full((n_s, n_t, nbins), I, dtype=np.int64)
+            for s in range(n_s):
+                for t in range(n_t):
+                    res = kmeans_1d(sorted[s, t], nbins)
+                    starts[s, t, :len(res)] = res
+            # one searchsorted for all rows, the rows are shifted apart by `I+1`
+            rows = (np.arange(n_s*n_t)*(I+1))[:, None]
+            sorted_codes = (np.searchsorted((starts.reshape(-1, nbins) + rows).ravel(), (first.reshape(-1, I) + rows).ravel(),
+                side="right") - np.repeat(np.arange(n_s*n_t)*nbins, I) - 1).reshape(n_s, n_t, I)
+        else:
+            raise ValueError(f"unknown method {method}")
+
+        self.codes = np.empty((n_s, n_t, I), dtype=np.int64)
+        np.put_along_axis(self.codes, np.broadcast_to(order, self.codes.shape), sorted_codes, axis=2)
+
+        flat = (self.codes + (np.arange(n_s*n_t)*nbins).reshape(n_s, n_t, 1)).ravel()
+        self.count = np.bincount(flat, minlength=n_s*n_t*nbins).reshape(n_s, n_t, nbins)
+        with np.errstate(invalid="ignore"):
+            self.mean = np.bincount(flat, weights=self.data.ravel(), minlength=n_s*n_t*nbins).reshape(n_s, n_t, nbins)/self.count
+        return self
+
+    def binning_shared(self, nbins):
+        """
+        "fixed" binning of generated paths, which is the same in all scenarios, see `binning`
+        """
+        n_s, n_t, I = self.data.shape
+        sorted = np.take_along_axis(self.W, self.order, axis=1)
+        first = np.where(np.diff(sorted, axis=1, prepend=-np.inf) != 0, np.arange(I), 0)
+        np.maximum.accumulate(first, axis=1, out=first)
+        k, m = divmod(I, nbins)
+        codes = np.empty((n_t, I), dtype=np.int64)
+        np.put_along_axis(codes, self.order,
+            np.searchsorted(np.array([i*k+min(i, m) for i in range(nbins)]), first, side="right")-1, axis=1)
+        self.codes = np.broadcast_to(codes, (n_s, n_t, I))
+
+        count = np.bincount((codes + np.arange(n_t)[:, None]*nbins).ravel(), minlength=n_t*nbins).reshape(n_t, nbins)
+        self.count = np.repeat(count[None], n_s, axis=0)
+        # sums of all scenarios as product with the indicator matrix of the bins
+        sums = np.empty((n_s, n_t, nbins))
+        for t in range(n_t):
+            member = sparse.csr_matrix((np.ones(I), (codes[t], np.arange(I))), shape=(nbins, I))
+            sums[:, t] = (member @ self.data[:, t].T).T
+        with np.errstate(invalid="ignore"):
+            self.mean = sums/self.count
+        return self
+
+    def build_lattice(self):
+        """
+        Build the block diagonal lattice of all scenarios from the transition counts of the bins
+
+        Bins with the same mean are merged into one node, as in `Simulation.create_edgelist`.
+
+        Returns
+        -------
+        Scenarios
+        """
+        n_s, n_t, nbins = self.count.shape
+        # nodes ordered by (timestep, scenario, bin), a new node starts at every change of the mean
+        rep = self.mean.transpose(1, 0, 2).reshape(n_t*n_s, nbins)
+        valid = self.count.transpose(1, 0, 2).reshape(n_t*n_s, nbins) > 0
+        row, col = np.nonzero(valid)
+        values = rep[row, col]
+        new = np.ones(len(row), dtype=bool)
+        new[1:] = (row[1:] != row[:-1]) | (values[1:] != values[:-1])
+        ids = np.cumsum(new)-1
+        node = np.full((n_t*n_s, nbins), -1, dtype=np.int64)
+        node[row, col] = ids
+        node = node.reshape(n_t, n_s, nbins)
+        t = (row // n_s)[new]
+        offsets = np.searchsorted(t, np.arange(n_t+1))
+
+        # shared bins have the same transition counts in all scenarios
+        codes = self.codes[:1] if self.codes.strides[0] == 0 else self.codes
+        pair = codes[:, :-1]*nbins + codes[:, 1:]
+        flat = (pair + (np.arange(len(codes)*(n_t-1))*nbins*nbins).reshape(len(codes), n_t-1, 1)).ravel()
+        counts = np.bincount(flat, minlength=len(codes)*(n_t-1)*nbins*nbins).reshape(len(codes), n_t-1, nbins, nbins)
+        counts = np.broadcast_to(counts, (n_s, n_t-1, nbins, nbins))
+        transitions = []
+        for ts in range(n_t-1):
+            s, b_p, b_c = np.nonzero(counts[:, ts])
+            P = sparse.csr_matrix((counts[s, ts, b_p, b_c].astype(float),
+                (node[ts, s, b_p]-offsets[ts], node[ts+1, s, b_c]-offsets[ts+1])),
+                shape=(offsets[ts+1]-offsets[ts], offsets[ts+2]-offsets[ts+1]))
+            totals = np.asarray(P.sum(axis=1)).ravel()
+            transitions.append(sparse.diags(1/np.where(totals > 0, totals, 1)) @ P)
+
+        self.node_scenario = (row % n_s)[new]
+        names = np.array([f"s{s}t{ts}n{i}" for i, (ts, s) in enumerate(zip(t, self.node_scenario))], dtype=object)
+        self.lattice = Lattice(names, values[new], t, [P.tocsr() for P in transitions])
+        self.roots = self.lattice.roots(self.node_scenario[:offsets[1]])
+        return self
+
+    def price(self, strike, type="call", opt="european"):
+        """
+        Option prices of all scenarios in one backward induction
+
+        Every scenario is discounted with `exp(-r*T/M)` per timestep, the discount factors are
+        folded into the transition matrices of the stacked lattice.
+
+        Parameters
+        ----------
+        strike: float or array-like
+            Strike prices
+        type: {"call", "put"} or array-like
+        opt: {"european", "american"} or array-like
+
+        Returns
+        -------
+        pd.DataFrame
+            with the parameters of the scenario, `strike, type, opt` and `price`, one row per
+            scenario and contract
+        """
+        if self.lattice is None:
+            self.build_lattice()
+        strike, _, type, opt = Lattice.contracts(strike, 1.0, type, opt)
+        discount = np.exp(-self.params["r"].to_numpy()*self.params["T"].to_numpy()/self.M)
+
+        lattice = self.lattice
+        transitions = []
+        for ts, P in enumerate(lattice.transitions):
+            s = self.node_scenario[lattice.offsets[ts]:lattice.offsets[ts+1]]
+            transitions.append(sparse.diags(discount[s]) @ P)
+        discounted = Lattice(lattice.names, lattice.values, lattice.t, transitions)
+        ev = discounted.backward_induction(strike, 1.0, type, opt, all_nodes=False)
+
+        res = self.params.loc[np.repeat(np.arange(len(self)), len(strike))].reset_index(drop=True)
+        res["strike"] = np.tile(strike, len(self))
+        res["type"] = np.tile(type, len(self))
+        res["opt"] = np.tile(opt, len(self))
+        res["price"] = ev[self.roots].ravel()
+        return res
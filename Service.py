@@ -0,0 +1,335 @@
+import time
+import json
+import asyncio
+import argparse
+import numpy as np
+from collections import OrderedDict, deque
+from Simulation import Simulation
+from Lattice import Lattice
+from Instrumentation import Callback
+
+class PricingService():
+    """
+    Local pricing service keeping lattices in memory and batching requests
+
+    Lattices are built on first use from the simulation parameters of a request (generate,
+    binning, create_edgelist) in a worker thread and kept for later requests, the least recently
+    used one is dropped if more than `max_lattices` are resident. Requests for the same lattice
+    which arrive within `max_delay` seconds are priced together by a single backward induction.
+
+    The service is available in process by `price` and over HTTP on localhost by `start`:
+    `POST /price` with a JSON body like the arguments of `price` returns `{"price": [...]}`,
+    `GET /stats` returns the statistics of `stats`.
+
+    Parameters
+    ----------
+    max_lattices: int
+        Number of resident lattices
+    max_delay: float
+        Seconds a request waits for other requests of the same lattice
+    max_batch: int
+        Number of contracts after which a batch is priced without waiting
+    cache: bool or Cache
+        Cache of the simulations, see `Simulation`
+    max_latencies: int
+        Number of latest requests the latency statistics are computed from
+    """
+
+    # parameters of the simulation identifying a lattice and their defaults
+    defaults = {"S0": 100., "T": 1.0, "r": 0.05, "sigma": 0.2, "M": 20, "I": 10000, "seed": 0,
+        "nbins": 4, "method": "fixed"}
+
+    def __init__(self, max_lattices=16, max_delay=0.002, max_batch=4096, cache=True, max_latencies=100000):
+        self.max_lattices = max_lattices
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.cache = cache
+        self.max_latencies = max_latencies
+        self.lattices = OrderedDict()
+        self.building = {}
+        self.queues = {}
+        self.server = None
+        self.connections = set()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.latencies = deque(maxlen=self.max_latencies)
+        self.requests = 0
+        self.batches = 0
+        self.contracts = 0
+        self.builds = 0
+        self.started = time.perf_counter()
+
+    def key(self, simulation):
+        """
+        Complete parameters of a simulation as hashable key
+        """
+        unknown = set(simulation) - set(self.defaults)
+        if unknown:
+            raise ValueError(f"unknown simulation parameters {sorted(unknown)}")
+        params = {**self.defaults, **simulation}
+        for name in ["M", "I", "nbins"]:
+            if isinstance(params[name], bool) or not isinstance(params[name], (int, np.integer)) or params[name] < 1:
+                raise ValueError(f"{name} has to be a positive integer, not {params[name]!r}")
+        if params["method"] not in ["fixed", "kmeans", "kmeans1d", "kmeans_warm"]:
+            raise ValueError(f"unknown binning method {params['method']}")
+        return tuple(params[k] for k in self.defaults)
+
+    def build(self, key):
+        """
+        Simulate, bin and build the lattice of a key, runs in a worker thread
+        """
+        p = dict(zip(self.defaults, key))
+        S = Simulation(cache=self.cache, callback=Callback())
+        S.generate(S0=p["S0"], T=p["T"], r=p["r"], sigma=p["sigma"], M=p["M"], I=p["I"], seed=p["seed"])
+        S.binning(nbins=p["nbins"], method=p["method"]).create_edgelist()
+        return Lattice.from_edgelist(S.edgelist)
+
+    async def lattice(self, key):
+        """
+        Resident lattice of a key, concurrent requests of a missing lattice wait for one build
+        """
+        if key in self.lattices:
+            self.lattices.move_to_end(key)
+            return self.lattices[key]
+        if key not in self.building:
+            self.building[key] = asyncio.get_running_loop().run_in_executor(None, self.build, key)
+        try:
+            lattice = await self.building[key]
+        finally:
+            self.building.pop(key, None)
+        if key not in self.lattices:
+            self.builds += 1
+            self.lattices[key] = lattice
+            while len(self.lattices) > self.max_lattices:
+                self.lattices.popitem(last=False)
+        return lattice
+
+    async def price(self, simulation=None, strike=100., discount=None, type="call", opt="european"):
+        """
+        Prices of options on the lattice of a simulation
+
+        Parameters
+        ----------
+        simulation: dict, optional
+            Parameters of the simulation, see `defaults`
+        strike: float or list
+            Strike prices
+        discount: float or list, optional
+            Discount factors for one timestep, defaults to `exp(-r*T/M)`
+        type: {"call", "put"} or list
+        opt: {"european", "american"} or list
+
+        Returns
+        -------
+        list
+            Price of every contract
+        """
+        start = time.perf_counter()
+        key = self.key(simulation or {})
+        if discount is None:
+            p = dict(zip(self.defaults, key))
+            discount = np.exp(-p["r"]*p["T"]/p["M"])
+        # invalid contracts are rejected before they can fail the batch of other requests
+        contracts = Lattice.contracts(strike, discount, type, opt)
+        if not (np.isfinite(contracts[0]).all() and np.isfinite(contracts[1]).all()):
+            raise ValueError("strike and discount have to be finite")
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self.queues.setdefault(key, [])
+        queue.append((contracts, future))
+        if len(queue) == 1:
+            asyncio.ensure_future(self.flush(key))
+        elif sum(len(c[0]) for c, _ in queue) >= self.max_batch:
+            self.queues.pop(key, None)
+            asyncio.ensure_future(self.run_batch(key, queue))
+        res = await future
+        self.latencies.append(time.perf_counter()-start)
+        self.requests += 1
+        return res
+
+    async def flush(self, key):
+        await asyncio.sleep(self.max_delay)
+        queue = self.queues.pop(key, None)
+        if queue:
+            await self.run_batch(key, queue)
+
+    async def run_batch(self, key, queue):
+        """
+        Price all contracts of the queued requests of one lattice by one backward induction
+
+        If pricing the batch fails, every request is priced on its own, so that only the failing
+        requests get the error.
+        """
+        try:
+            lattice = await self.lattice(key)
+            strike, discount, type, opt = [np.concatenate([c[i] for c, _ in queue]) for i in range(4)]
+            ev = lattice.backward_induction(strike, discount, type, opt, all_nodes=False)
+            prices = ev[lattice.root]
+        except Exception as e:
+            if len(queue) > 1 and key in self.lattices:
+                for item in queue:
+                    await self.run_batch(key, [item])
+                return
+            for _, future in queue:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.contracts += len(strike)
+        start = 0
+        for contracts, future in queue:
+            if not future.done():
+                future.set_result(prices[start:start+len(contracts[0])].tolist())
+            start += len(contracts[0])
+
+    def stats(self):
+        """
+        Latency and throughput since the start or the last `reset_stats`
+
+        Returns
+        -------
+        dict
+            with the keys `requests, contracts, batches, mean_batch, builds, lattices, seconds,
+            throughput` (requests per second) and the latency quantiles `p50, p90, p99, max` in seconds
+            of the last `max_latencies` requests
+        """
+        latencies = np.array(self.latencies)
+        seconds = time.perf_counter()-self.started
+        res = {"requests": self.requests, "contracts": self.contracts, "batches": self.batches,
+            "mean_batch": self.contracts/self.batches if self.batches else 0.0,
+            "builds": self.builds, "lattices": len(self.lattices), "seconds": seconds,
+            "throughput": self.requests/seconds}
+        for name, q in [("p50", 50), ("p90", 90), ("p99", 99), ("max", 100)]:
+            res[name] = float(np.percentile(latencies, q)) if len(latencies) else None
+        return res
+
+    async def handle(self, reader, writer):
+        """
+        Serve the HTTP/1.1 requests of one connection
+        """
+        self.connections.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, path, _ = line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode().split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, res = "200 OK", None
+                try:
+                    if method == "POST" and path == "/price":
+                        res = {"price": await self.price(**json.loads(body or b"{}"))}
+                    elif method == "GET" and path == "/stats":
+                        res = self.stats()
+                    else:
+                        status, res = "404 Not Found", {"error": f"{method} {path}"}
+                except (ValueError, TypeError, KeyError) as e:
+                    status, res = "400 Bad Request", {"error": str(e)}
+                except Exception as e:
+                    status, res = "500 Internal Server Error", {"error": f"{e.__class__.__name__}: {e}"}
+                data = json.dumps(res).encode()
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=0):
+        """
+        Start the HTTP server, `port=0` picks a free port
+
+        Returns
+        -------
+        int
+            Port of the server
+        """
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            for writer in list(self.connections):
+                writer.close()
+            await self.server.wait_closed()
+            self.server = None
+
+class PricingClient():
+    """
+    Minimal asyncio client of a `PricingService` with one persistent connection
+
+    Parameters
+    ----------
+    host: string
+    port: int
+    """
+
+    def __init__(self, host="127.0.0.1", port=8000):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        data = b"" if body is None else json.dumps(body).encode()
+        self.writer.write(f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+        await self.writer.drain()
+        status = (await self.reader.readline()).decode()
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, value = line.decode().split(":", 1)
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        res = json.loads(await self.reader.readexactly(length))
+        if not status.split(" ")[1].startswith("2"):
+            raise ValueError(res.get("error", status))
+        return res
+
+    async def price(self, **kwargs):
+        """
+        Prices of the contracts, see `PricingService.price`
+        """
+        return (await self.request("POST", "/price", kwargs))["price"]
+
+    async def stats(self):
+        return await self.request("GET", "/stats")
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local pricing service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-delay", type=float, default=0.002)
+    parser.add_argument("--max-lattices", type=int, default=16)
+    args = parser.parse_args()
+
+    async def main():
+        service = PricingService(max_lattices=args.max_lattices, max_delay=args.max_delay)
+        port = await service.start(args.host, args.port)
+        print(f"serving on http://{args.host}:{port}")
+        await service.server.serve_forever()
+
+    asyncio.run(main())
@@ -1,25 +1,139 @@
 import pandas as pd
 import numpy as np
-from collections import defaultdict, Counter
 from itertools import zip_longest
-from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import os
 import math
-from sklearn.cluster import KMeans
-import matplotlib.pyplot as plt
+from collections import deque
+from Bins import Bins
+from Cache import Cache
+from Instrumentation import Callback, TqdmCallback, instrument
 
 np.random.seed(0)
 
+def kmeans_1d(x, k):
+    """
+    Optimal k-means clustering of sorted one dimensional data
+
+    Dynamic programming over the number of clusters. As the optimal split point is monotone in the
+    number of elements, every layer of the DP is solved by divide and conquer in O(n log n); all
+    subproblems of one recursion level are evaluated together with array operations.
+
+    The cost is O(k n log n) and every recursion level passes over all elements, so for many
+    elements and more than a few clusters this is slower than the Lloyd iterations of sklearn's
+    `KMeans` (see `misc/benchmarks.py kmeans`). Its advantages are the optimal inertia and the
+    deterministic result, not speed.
+
+    Parameters
+    ----------
+    x: np.ndarray
+        Sorted data
+    k: int
+        Number of clusters, at most `len(x)` clusters are returned
+
+    Returns
+    -------
+    np.ndarray
+        Start index of every cluster in `x`, the first one is always 0
+    """
+    n = len(x)
+    k = max(1, min(k, n))
+    x = np.asarray(x, dtype=float) - np.mean(x)
+    c1 = np.concatenate([[0.0], np.cumsum(x)])
+    c2 = np.concatenate([[0.0], np.cumsum(x*x)])
+
+    def cost(j, i):
+        # sum of squared deviations of x[j:i]
+        s = c1[i]-c1[j]
+        return c2[i]-c2[j] - s*s/(i-j)
+
+    # D[i]: minimal cost of the first i elements, opt[l][i]: start of the last cluster
+    D = np.full(n+1, np.inf)
+    D[1:] = cost(0, np.arange(1, n+1))
+    opt = []
+    for layer in range(2, k+1):
+        A = D - c2
+        D_new = np.full(n+1, np.inf)
+        arg = np.zeros(n+1, dtype=np.int64)
+        # open subproblems: range of i and range of the split point j, only the last
+        # element is needed for the last layer
+        i_lo, i_hi = np.array([layer if layer < k else n]), np.array([n])
+        j_lo, j_hi = np.array([layer-1]), np.array([n-1])
+        while len(i_lo):
+            mid = (i_lo+i_hi)//2
+            lengths = np.minimum(j_hi, mid-1)-j_lo+1
+            seg_start = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+            seg = np.repeat(np.arange(len(mid)), lengths)
+            j = np.arange(len(seg)) - (seg_start-j_lo)[seg]
+            # cost(j, mid) without the term c2[mid], which is the same for the whole subproblem
+            s = c1[mid][seg] - c1[j]
+            vals = A[j] - s*s/(mid[seg]-j)
+            best = np.minimum.reduceat(vals, seg_start)
+            # leftmost minimum of every subproblem
+            hit = np.flatnonzero(vals == best[seg])
+            hit = hit[np.searchsorted(hit, seg_start)]
+            best_j = j[hit]
+            D_new[mid], arg[mid] = best + c2[mid], best_j
+
+            left, right = i_lo <= mid-1, mid+1 <= i_hi
+            i_lo, i_hi, j_lo, j_hi = (
+                np.concatenate([i_lo[left], (mid+1)[right]]),
+                np.concatenate([(mid-1)[left], i_hi[right]]),
+                np.concatenate([j_lo[left], best_j[right]]),
+                np.concatenate([best_j[left], j_hi[right]]))
+        D = D_new
+        opt.append(arg)
+
+    starts = [0]*k
+    i = n
+    for layer in range(k, 1, -1):
+        i = opt[layer-2][i]
+        starts[layer-1] = i
+    return np.array(starts, dtype=np.int64)
+
 class Simulation():
 
-    def __init__(self):
+    def __init__(self, cache=True, callback=None):
+        """
+        Parameters
+        ----------
+        cache: bool or Cache
+            On-disk cache for paths, bins and edgelists. `True` uses the shared default cache,
+            `False` disables caching. Only simulations generated with a `seed` are cached.
+        callback: Callback, optional
+            Receives the progress and metrics of `generate`, `binning` and `create_edgelist`, see
+            `Instrumentation`. Defaults to a progress bar for `binning`, `Callback()` is silent.
+            Every instrumented method also takes a `callback` for a single call.
+        """
+        self.callback = TqdmCallback(stages=["binning"]) if callback is None else callback
         self.data = None
         self.bin_data = None
         self.edgelist = None
-        
-    def generate(self, S0 = 100., T = 1.0, r = 0.05, sigma = 0.2, M = 20, I = 100):
+        self.cache = Cache.default() if cache is True else (cache or None)
+        # cache keys of the current data, bins and edgelist
+        self.data_key = None
+        self.bins_key = None
+        self.edgelist_key = None
+        # parameters of the last generate, binning and create_edgelist, used by `extend`
+        self.params = None
+        self.bin_params = None
+        self.edgelist_params = None
+        # transition counts and first path of every pair of bins, shape (M, nbins*nbins)
+        self.transition_counts = None
+        self.transition_first = None
+        self.n_chunks = 0
+        self.buffer = None
+
+    @instrument("generate", items=lambda self: self.data.shape[1], nbytes=lambda self: self.data.nbytes)
+    def generate(self, S0 = 100., T = 1.0, r = 0.05, sigma = 0.2, M = 20, I = 100, seed = None, chunk_size = None,
+            path = None, sampler = "pseudo", n_jobs = 1, dtype = np.float64, out = None):
         """
         Monte Carlo simulation for generating paths
 
+        The standard normals are drawn as one block per chunk (row blocks of at most `2**20`
+        elements without a seed), turned into log increments and summed up in log space in the
+        result matrix, which is exponentiated in place.
+
         Parameters:
         -----------
         S0: float
@@ -34,25 +148,442 @@ class Simulation():
             Timesteps in `T`
         I: int
             Number of paths to generate
+        seed: int, optional
+            If given, the paths are generated in chunks of `chunk_size` paths, every chunk with its
+            own random generator spawned from `seed`. The paths are the same as the ones of
+            `stream` with the same `seed` and `chunk_size`. Otherwise numpy's global random state is used,
+            with `sampler="pseudo"` and `n_jobs=1` path by path as before, else to draw a seed.
+        chunk_size: int, optional
+            Number of paths per chunk, defaults to `I`
+        path: string, optional
+            `.npy` file the paths are written to instead of memory. Afterwards `data` is a read-only
+            memory map of the file, see `open`.
+        sampler: {"pseudo", "antithetic", "sobol"}
+            Standard normals of the chunks, see `generate_chunk`
+        n_jobs: int
+            Number of threads generating chunks, the paths do not depend on it
+        dtype: {np.float64, np.float32}
+            Data type of the paths. float32 halves the memory, with a seed its paths are drawn from
+            float32 normals and differ from the float64 ones.
+        out: np.ndarray, optional
+            Matrix of shape `(M+1, I)` the paths are written to, its dtype is used
         
         Returns:
         --------
         np.ndarray
             Matrix with shape `(M+1, I)`
         """
-        dt = T/M
-        #I Paths with M timesteps
+        self.data_key = self.bins_key = self.edgelist_key = None
+        self.bin_data = self.edgelist = self.buffer = None
+        if sampler not in ["pseudo", "antithetic", "sobol"]:
+            raise ValueError(f"unknown sampler {sampler}")
+        if out is not None:
+            if out.shape != (M+1, I):
+                raise ValueError(f"out needs the shape {(M+1, I)}, not {out.shape}")
+            dtype = out.dtype
+        dtype = np.dtype(dtype)
+        if dtype not in (np.float32, np.float64):
+            raise ValueError(f"unsupported dtype {dtype}")
+        if seed is None and (sampler != "pseudo" or n_jobs > 1):
+            seed = int(np.random.randint(2**32))
+        self.params = {"S0": S0, "T": T, "r": r, "sigma": sigma, "M": M, "seed": seed, "chunk_size": chunk_size or I,
+            "sampler": sampler, "n_jobs": n_jobs, "dtype": dtype}
+        self.n_chunks = -(-I // (chunk_size or I))
+        key = None
+        if seed is not None and path is None and self.cache:
+            key = Cache.key("paths", S0=S0, T=T, r=r, sigma=sigma, M=M, I=I, seed=seed, chunk_size=chunk_size,
+                sampler=sampler, dtype=dtype.name)
+            cached = self.cache.get_array(key)
+            if cached is not None:
+                if out is not None:
+                    out[...] = cached
+                    cached = out
+                self.data = cached
+                self.data_key = key
+                return self
 
-        S = np.zeros(shape = (M+1, I))
-        S[0] = S0
+        if out is not None:
+            S = out
+        elif path is None:
+            S = np.empty(shape = (M+1, I), dtype=dtype)
+        else:
+            S = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(M+1, I))
+
+        if seed is not None:
+            chunks = self.generate_chunks(S0, T, r, sigma, M, I, seed, chunk_size, sampler=sampler, n_jobs=n_jobs,
+                out=S)
+            for _ in self.stage.progress(chunks, self.n_chunks):
+                pass
+        else:
+            #I Paths with M timesteps, die Normalverteilten in der Reihenfolge der Zeitschritte
+            rows = max(1, 2**20 // max(I, 1))
+            for t in range(1, M+1, rows):
+                S[t:t+rows] = np.random.standard_normal((min(rows, M+1-t), I))
+            self.log_paths(S, S0, T, r, sigma)
+
+        if path is not None:
+            S.flush()
+            del S
+            return self.attach(path)
 
-        for t in range(1, M+1):
-            z = np.random.standard_normal(I)
-            # gehedgtes Portfolio
-            S[t] = S[t-1] * np.exp((r-0.5*sigma**2)*dt + sigma*math.sqrt(dt)*z)
         self.data = S
+        if key is not None:
+            self.cache.put_array(key, self.data)
+            self.data_key = key
+        return self
+
+    @classmethod
+    def open(cls, path, cache=True):
+        """
+        Create a Simulation from an existing path file without regenerating the paths
+
+        Parameters
+        ----------
+        path: string
+            `.npy` file with a matrix of shape `(M+1, I)`, e.g. written by `generate(path=...)`
+        cache: bool or Cache
+            see `Simulation`
+
+        Returns
+        -------
+        Simulation
+        """
+        return cls(cache=cache).attach(path)
+
+    def attach(self, path):
+        """
+        Use a path file as read-only memory mapped `data`
+
+        The rows of the file are read on demand, so the file can be larger than the memory and be
+        shared by several processes. The file's path, size and modification time identify the
+        data for the cache.
+
+        Parameters
+        ----------
+        path: string
+            `.npy` file with a matrix of shape `(M+1, I)`
+        """
+        self.data = np.load(path, mmap_mode="r")
+        stat = os.stat(path)
+        self.data_key = Cache.key("file", path=os.path.abspath(path), size=stat.st_size, mtime=stat.st_mtime_ns)
+        self.bins_key = self.edgelist_key = None
+        self.bin_data = self.edgelist = None
+        return self
+
+    def generate_chunks(self, S0, T, r, sigma, M, I, seed, chunk_size=None, first_chunk=0, sampler="pseudo", n_jobs=1,
+            out=None):
+        """
+        Generate the paths of a simulation chunk by chunk
+
+        Every chunk uses its own `np.random.Generator` spawned from `seed`, so every chunk
+        can be regenerated independently of the others. With `n_jobs > 1` the chunks are generated
+        by a thread pool (numpy releases the GIL while drawing and transforming the normals), at
+        most `n_jobs` chunks ahead of the consumer, and yielded in order.
+
+        Parameters
+        ----------
+        S0, T, r, sigma, M, I, sampler:
+            see `generate`
+        seed: int
+            Seed of the `np.random.SeedSequence` the generators of the chunks are spawned from
+        chunk_size: int, optional
+            Number of paths per chunk, defaults to `I`
+        first_chunk: int
+            Index of the first chunk, chunk `j` always uses the `j`-th generator spawned from `seed`
+        n_jobs: int
+            Number of threads
+        out: np.ndarray, optional
+            Matrix of shape `(M+1, I)`, every chunk is written to its columns and yielded as view
+
+        Yields
+        ------
+        np.ndarray
+            Matrix with shape `(M+1, chunk_size)`, the last chunk may be smaller
+        """
+        chunk_size = I if chunk_size is None else chunk_size
+        chunks = [(j, min(chunk_size, I-start), start)
+            for j, start in enumerate(range(0, I, chunk_size), start=first_chunk)]
+        view = lambda n, start: None if out is None else out[:, start:start+n]
+        if n_jobs <= 1:
+            for j, n, start in chunks:
+                yield self.generate_chunk(S0, T, r, sigma, M, n, seed, j, sampler, out=view(n, start))
+            return
+
+        with ThreadPoolExecutor(n_jobs) as executor:
+            pending = deque()
+            for j, n, start in chunks:
+                pending.append(executor.submit(self.generate_chunk, S0, T, r, sigma, M, n, seed, j, sampler,
+                    out=view(n, start)))
+                if len(pending) > n_jobs:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    @staticmethod
+    def generate_chunk(S0, T, r, sigma, M, n, seed, j, sampler="pseudo", dtype=np.float64, out=None):
+        """
+        Paths of chunk `j`
+
+        Parameters
+        ----------
+        S0, T, r, sigma, M:
+            see `generate`
+        n: int
+            Number of paths
+        seed: int
+            Seed of the `np.random.SeedSequence`, the chunk uses its `j`-th child
+        j: int
+            Index of the chunk
+        sampler: {"pseudo", "antithetic", "sobol"}
+            "pseudo" draws independent standard normals. "antithetic" draws the normals of the
+            first half of the paths and uses their negation for the second half. "sobol" transforms
+            a scrambled Sobol sequence with one dimension per timestep by the inverse normal cdf,
+            scrambled by the generator of the chunk.
+        dtype: {np.float64, np.float32}
+            Data type of the normals and the paths
+        out: np.ndarray, optional
+            Matrix with shape `(M+1, n)` the paths are written to, its dtype is used
+
+        Returns
+        -------
+        np.ndarray
+            Matrix with shape `(M+1, n)`
+        """
+        rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(j,)))
+        S = np.empty(shape = (M+1, n), dtype=dtype) if out is None else out
+        # the generator fills only contiguous arrays, column blocks of a larger matrix are copied
+        z = S[1:] if S[1:].flags.c_contiguous else np.empty((M, n), dtype=S.dtype)
+        if sampler == "pseudo":
+            rng.standard_normal((M, n), dtype=S.dtype, out=z)
+        elif sampler == "antithetic":
+            h = (n+1)//2
+            z[:, :h] = rng.standard_normal((M, h), dtype=S.dtype)
+            z[:, h:] = -z[:, :n-h]
+        elif sampler == "sobol":
+            from scipy.special import ndtri
+            from scipy.stats import qmc
+            u = qmc.Sobol(d=M, scramble=True, seed=rng).random(n)
+            z[...] = ndtri(np.clip(u, 1e-16, 1-1e-16)).T
+        else:
+            raise ValueError(f"unknown sampler {sampler}")
+        if z is not S[1:]:
+            S[1:] = z
+        return Simulation.log_paths(S, S0, T, r, sigma)
+
+    @staticmethod
+    def log_paths(S, S0, T, r, sigma):
+        """
+        Turn standard normals into paths in place
+
+        Parameters
+        ----------
+        S: np.ndarray
+            Matrix with shape `(M+1, n)` with the standard normals of the timesteps in `S[1:]`
+        S0, T, r, sigma:
+            see `generate`
+
+        Returns
+        -------
+        np.ndarray
+            `S` with the paths
+        """
+        dt = T/(len(S)-1)
+        S[0] = S0
+        S[1:] *= sigma*math.sqrt(dt)
+        S[1:] += (r-0.5*sigma**2)*dt
+        np.cumsum(S[1:], axis=0, out=S[1:])
+        np.exp(S[1:], out=S[1:])
+        S[1:] *= S0
+        return S
+
+    def stream(self, S0 = 100., T = 1.0, r = 0.05, sigma = 0.2, M = 20, I = 100, nbins = 4, seed = 0,
+            chunk_size = 100000, resolution = 2**14, sampler = "pseudo", n_jobs = 1):
+        """
+        Simulation, fixed size binning and edgelist creation without keeping the paths in memory
+
+        The paths are generated twice chunk by chunk (see `generate_chunks`). The first pass builds
+        a mergeable histogram sketch of every timestep on a grid of `resolution` cells in log space,
+        from which the bin edges of the "fixed" binning method are interpolated. The second pass
+        assigns the paths of every chunk to the bins and accumulates the bin sums and the
+        transition counts. Peak memory is bounded by `chunk_size` and `resolution` instead of `I`.
+
+        The bin edges are exact up to the resolution of the sketch, paths very close to an edge
+        may end up in a neighbouring bin compared to `binning(method="fixed")`.
+
+        Parameters
+        ----------
+        S0, T, r, sigma, M, I, seed, chunk_size, sampler, n_jobs:
+            see `generate`
+        nbins: int
+            Number of bins per timestep
+        resolution: int
+            Number of cells of the histogram sketch per timestep
+
+        Returns
+        -------
+        Simulation
+            with `edgelist` and `bin_data` attribute set, `data` is None
+        """
+        self.data_key = self.bins_key = self.edgelist_key = None
+        chunks = lambda: self.generate_chunks(S0, T, r, sigma, M, I, seed, chunk_size, sampler=sampler, n_jobs=n_jobs)
+
+        # sketch grid: +-8 standard deviations around the mean of the log prices
+        t = np.arange(M+1)*T/M
+        center = math.log(S0) + (r-0.5*sigma**2)*t
+        width = np.maximum(16*sigma*np.sqrt(t), 1e-9)/resolution
+        lower = center - width*resolution/2
+
+        hist = np.zeros((M+1, resolution), dtype=np.int64)
+        vmin, vmax = np.full(M+1, np.inf), np.full(M+1, -np.inf)
+        for S in chunks():
+            cell = np.clip(((np.log(S) - lower[:, None])/width[:, None]).astype(np.int64), 0, resolution-1)
+            hist += np.bincount((cell + np.arange(M+1)[:, None]*resolution).ravel(),
+                minlength=(M+1)*resolution).reshape(M+1, resolution)
+            vmin, vmax = np.minimum(vmin, S.min(axis=1)), np.maximum(vmax, S.max(axis=1))
+
+        # upper edge of every bin but the last one, at the rank of the largest element of the bins of `split`
+        k, m = divmod(I, nbins)
+        ranks = np.array([(b+1)*k+min(b+1, m)-1 for b in range(nbins-1)])
+        cum = np.cumsum(hist, axis=1)
+        edges = np.empty((M+1, nbins-1))
+        for i in range(M+1):
+            cell = np.searchsorted(cum[i], ranks, side="right")
+            before = np.where(cell > 0, cum[i][cell-1], 0)
+            frac = (ranks - before + 1)/hist[i][cell]
+            edges[i] = np.clip(np.exp(lower[i] + (cell+frac)*width[i]), vmin[i], vmax[i])
+
+        sums = np.zeros((M+1, nbins))
+        counts = np.zeros((M+1, nbins), dtype=np.int64)
+        self.reset_transitions(M, nbins)
+        offset = 0
+        for S in chunks():
+            codes = np.stack([np.searchsorted(edges[i], S[i], side="left") for i in range(M+1)])
+            flat = codes + np.arange(M+1)[:, None]*nbins
+            sums += np.bincount(flat.ravel(), weights=S.ravel(), minlength=(M+1)*nbins).reshape(M+1, nbins)
+            counts += np.bincount(flat.ravel(), minlength=(M+1)*nbins).reshape(M+1, nbins)
+            for i in range(M):
+                self.count_transitions(i, codes[i], codes[i+1], offset)
+            offset += S.shape[1]
+
+        with np.errstate(invalid="ignore"):
+            rep = sums/counts
+
+        self.data = None
+        self.params = self.bin_params = self.edgelist_params = None
+        # the bounds of the bins are the edges of the sketch, medians are not tracked
+        self.bin_data = Bins(
+            lo=np.column_stack([vmin, edges]),
+            hi=np.column_stack([edges, vmax]),
+            mean=rep, median=np.full_like(rep, np.nan), count=counts)
+        self.edgelist = self.build_edgelist([self.merge_nodes(i, rep) for i in range(M)])
         return self
-    
+
+    def extend(self, n_paths, tree=None, rebin=False):
+        """
+        Add paths to the simulation without recomputing the existing ones
+
+        The new paths continue the random stream of `generate`: with a seed, the next chunks
+        use the next generators spawned from it. If the simulation was binned, the new paths are
+        assigned to the existing bins, whose bounds, counts and means are updated, and their
+        transitions are added to the transition counts behind the edgelist. The cost scales with
+        `n_paths`, not with the total number of paths.
+
+        Parameters
+        ----------
+        n_paths: int
+            Number of paths to add
+        tree: Tree, optional
+            Tree created by `Tree.from_S(self)`, which is updated in place
+        rebin: bool
+            If True, the bins and the edgelist are recomputed from all paths instead of keeping the
+            bins fixed
+
+        Returns
+        -------
+        Simulation
+        """
+        if self.params is None or self.data is None:
+            raise ValueError("extend needs a Simulation created by `generate`")
+        if isinstance(self.data, np.memmap):
+            raise ValueError("memory mapped simulations can not be extended")
+        if self.edgelist is not None and self.transition_counts is None and not rebin:
+            # edgelists from older cache entries come without transition counts
+            self.recount_transitions()
+
+        p = self.params
+        if p["seed"] is not None:
+            new = np.empty((p["M"]+1, n_paths), dtype=self.data.dtype)
+            for _ in self.generate_chunks(p["S0"], p["T"], p["r"], p["sigma"], p["M"], n_paths, p["seed"],
+                    p["chunk_size"], first_chunk=self.n_chunks, sampler=p["sampler"], n_jobs=p["n_jobs"], out=new):
+                pass
+            self.n_chunks += -(-n_paths // p["chunk_size"])
+        else:
+            new = np.empty((p["M"]+1, n_paths), dtype=self.data.dtype)
+            new[1:] = np.random.standard_normal((p["M"], n_paths))
+            self.log_paths(new, p["S0"], p["T"], p["r"], p["sigma"])
+
+        # paths are appended to a buffer with spare capacity, so extending is amortized O(n_paths)
+        n_old = self.data.shape[1]
+        total = n_old + n_paths
+        if self.buffer is None or self.buffer.shape[1] < total:
+            self.buffer = np.empty((self.data.shape[0], max(total, 2*n_old)), dtype=self.data.dtype)
+            self.buffer[:, :n_old] = self.data
+        self.buffer[:, n_old:total] = new
+        self.data = self.buffer[:, :total]
+        self.data_key = self.bins_key = self.edgelist_key = None
+
+        if self.bin_data is None:
+            return self
+        if rebin:
+            self.binning(**self.bin_params)
+            if self.edgelist_params is not None:
+                self.create_edgelist(**self.edgelist_params)
+        else:
+            self.update_bins(new, n_old)
+            if self.edgelist_params is not None:
+                if not self.edgelist_params["unique_edges"]:
+                    raise ValueError("edgelists with one edge per path can only be extended with rebin=True")
+                rep = getattr(self.bin_data, self.edgelist_params["statistic"])
+                if np.isnan(rep[self.bin_data.count > 0]).any():
+                    raise ValueError("medians of fixed bins can not be updated, extend with rebin=True")
+                self.edgelist = self.build_edgelist([self.merge_nodes(i, rep) for i in range(len(rep)-1)])
+        self.bin_data.data = self.data
+
+        if tree is not None and self.edgelist is not None:
+            tree.from_S(self)
+        return self
+
+    def update_bins(self, new, offset):
+        """
+        Add paths to the existing bins and transition counts
+
+        The bounds of a bin are widened to the values assigned to it, the means are updated, the
+        medians can not be updated and are set to NaN.
+
+        Parameters
+        ----------
+        new: np.ndarray
+            New paths of shape `(M+1, n)`
+        offset: int
+            Index of the first new path
+        """
+        bins = self.bin_data
+        nbins = bins.count.shape[1]
+        prev = None
+        for i in range(new.shape[0]):
+            codes = self.assign_bins(i, new[i], strict=False)
+            counts = np.bincount(codes, minlength=nbins)
+            sums = np.bincount(codes, weights=new[i], minlength=nbins)
+            hit = counts > 0
+            bins.mean[i, hit] = (bins.mean[i, hit]*bins.count[i, hit] + sums[hit])/(bins.count[i, hit]+counts[hit])
+            bins.count[i] += counts
+            np.minimum.at(bins.lo[i], codes, new[i])
+            np.maximum.at(bins.hi[i], codes, new[i])
+            if prev is not None and self.transition_counts is not None:
+                self.count_transitions(i-1, prev, codes, offset)
+            prev = codes
+        bins.median[:] = np.nan
+
     def split(self, a, n):
         """
         Split an iterable into n chunks with approximatly the same size
@@ -74,6 +605,9 @@ class Simulation():
         """
         Binning into `n` bins with approximatly same number of elements
 
+        The bins are the chunks of `split` applied to the sorted data, their order statistics
+        are found with `np.partition` instead of a full sort.
+
         Parameters
         ----------
         S_t: np.array
@@ -84,90 +618,505 @@ class Simulation():
         Returns
         -------
         dict
-            dict of the form
-            `bin{idx}: [1,2,3,...]`
+            Statistics of the bins, see `Bins.summarize`
         """
-        sorted = np.sort(S_t)
-        return {f"bin{idx}": item for idx, item in enumerate(list(self.split(sorted, n)))}
+        k, m = divmod(len(S_t), n)
+        return Bins.summarize(S_t, [i*k+min(i, m) for i in range(n)])
 
-    def binning_t_kmeans(self, S_t, n):
-        #bin{idx}: [1,2,3,...]
-        
-        res = defaultdict(list)
+    def binning_t_kmeans(self, S_t, n, init=None, max_iter=300, mini_batch=None):
+        """
+        Binning into `n` bins by sklearn's `KMeans`
+
+        In one dimension the clusters are intervals ordered like their centers. If `KMeans` fails,
+        the optimal bins of `binning_t_kmeans1d` are used, which take longer for many bins.
+
+        Parameters
+        ----------
+        S_t: np.array
+            One element/data of one timestep of self.data
+        n: integer
+            Number of bins
+        init: np.ndarray, optional
+            Initial centers, `k-means++` with random restarts if None
+        max_iter: int
+            Maximal number of iterations
+        mini_batch: int, optional
+            Batch size of `MiniBatchKMeans`, which is used instead of `KMeans` if there are more
+            elements than `mini_batch`
+
+        Returns
+        -------
+        dict
+            Statistics of the bins, see `Bins.summarize`
+        """
+        from sklearn.cluster import KMeans, MiniBatchKMeans
+        start = {'init': 'k-means++'} if init is None else {'init': np.reshape(init, (-1, 1)), 'n_init': 1}
         try:
-            kmeans = KMeans(n_clusters=n, init='k-means++', random_state=0).fit(S_t.reshape(-1,1))
-            tpl_list = [(j, i) for i, j in zip(S_t, kmeans.labels_)]
-            for i, j in tpl_list:
-                res[f"bin{i}"].append(j)
-            res_list = sorted(list(res.values()), key=lambda x: min(x))
-            for i in range(n):
-                res[f"bin{i}"]=res_list[i]
-        except Exception as e:
-            print(e)
-            for i in range(n):
-                res[f"bin{i}"]=[S_t[0]]
+            if mini_batch is not None and len(S_t) > mini_batch:
+                kmeans = MiniBatchKMeans(n_clusters=n, **start, max_iter=max_iter, batch_size=mini_batch,
+                    random_state=0).fit(S_t.reshape(-1,1))
+            else:
+                kmeans = KMeans(n_clusters=n, **start, max_iter=max_iter, random_state=0).fit(S_t.reshape(-1,1))
+        except Exception:
+            return self.binning_t_kmeans1d(S_t, n)
+        counts = np.bincount(kmeans.labels_, minlength=n)[np.argsort(kmeans.cluster_centers_[:, 0])]
+        return Bins.summarize(S_t, np.concatenate([[0], np.cumsum(counts)[:-1]]))
+
+    def binning_kmeans_warm(self, n, max_iter=20, mini_batch=None, progress=iter):
+        """
+        Binning of all timesteps by `KMeans` started from the centers of the previous timestep
+
+        The centers of timestep `t-1` are scaled by the ratio of the means of timestep `t` and
+        `t-1` (the drift) and used as initial centers of timestep `t`, so few iterations are needed
+        and the bins keep their identity from one timestep to the next. Timesteps after one with
+        less than `n` bins, like the first one, are started by `k-means++`.
+
+        Parameters
+        ----------
+        n: integer
+            Number of bins
+        max_iter, mini_batch:
+            see `binning_t_kmeans`, `max_iter` applies to the warm started timesteps
+        progress: callable
+            Wraps the iterable of the timesteps, e.g. for progress updates
+
+        Returns
+        -------
+        list
+            Statistics of the bins of every timestep, see `Bins.summarize`
+        """
+        res = []
+        centers, mean = None, None
+        for i in progress(range(self.data.shape[0])):
+            S_t = np.asarray(self.data[i])
+            if centers is not None and len(centers) == n:
+                stats = self.binning_t_kmeans(S_t, n, init=centers*(S_t.mean()/mean), max_iter=max_iter,
+                    mini_batch=mini_batch)
+            else:
+                stats = self.binning_t_kmeans(S_t, n, mini_batch=mini_batch)
+            res.append(stats)
+            centers, mean = stats["mean"], S_t.mean()
         return res
 
-    def binning(self, nbins=4, method="fixed"):
-        _n = int(len(self.data[0])/nbins)
-        res_dict = dict()
-        #for every timestep
-        for i in tqdm(range(self.data.shape[0]), desc=f"binning using {method}"):
-            if method=="kmeans":
-                res_dict[f"t{i}"] = self.binning_t_kmeans(self.data[i], n=nbins)
-            elif method=="fixed":
-                res_dict[f"t{i}"] = self.binning_t_fs(self.data[i], n=nbins)
-        self.bin_data = res_dict
+    def binning_t_kmeans1d(self, S_t, n):
+        """
+        Binning into `n` bins by optimal one dimensional k-means, see `kmeans_1d`
+
+        Deterministic, without random initialization and with the optimal inertia, in contrast to
+        `binning_t_kmeans`, but slower than it for many elements and bins.
+
+        Parameters
+        ----------
+        S_t: np.array
+            One element/data of one timestep of self.data
+        n: integer
+            Number of bins
+
+        Returns
+        -------
+        dict
+            Statistics of the bins, see `Bins.summarize`
+        """
+        sorted = np.sort(S_t)
+        return Bins.summarize(sorted, kmeans_1d(sorted, n), is_sorted=True)
+
+    def binning_t(self, S_t, n, method):
+        """
+        Binning of one timestep with the given method
+
+        Parameters
+        ----------
+        S_t: np.array
+            One element/data of one timestep of self.data
+        n: integer
+            Number of bins
+        method: {"fixed", "kmeans", "kmeans1d"}
+
+        Returns
+        -------
+        dict
+            Statistics of the bins, see `Bins.summarize`
+        """
+        if method=="kmeans":
+            return self.binning_t_kmeans(S_t, n=n)
+        elif method=="kmeans1d":
+            return self.binning_t_kmeans1d(S_t, n=n)
+        elif method=="fixed":
+            return self.binning_t_fs(S_t, n=n)
+        raise ValueError(f"unknown binning method {method}")
+
+    def binning_t_file(self, row, n, method):
+        """
+        Binning of one timestep read from a `.npy` path file
+
+        Parameters
+        ----------
+        row: tuple
+            `(path, i)` of the file and the timestep
+        n: integer
+            Number of bins
+        method: {"fixed", "kmeans", "kmeans1d"}
+
+        Returns
+        -------
+        dict
+            Statistics of the bins, see `Bins.summarize`
+        """
+        path, i = row
+        return self.binning_t(np.load(path, mmap_mode="r")[i], n, method)
+
+    @instrument("binning", items=lambda self: int(np.sum(self.bin_data.count > 0)),
+        nbytes=lambda self: sum(getattr(self.bin_data, a).nbytes for a in ["lo", "hi", "mean", "median", "count"]))
+    def binning(self, nbins=4, method="fixed", n_jobs=1, backend="process", max_iter=20, mini_batch=None):
+        """
+        Binning of every timestep of self.data
+
+        The timesteps are independent of each other and can be binned in parallel. The result
+        does not depend on `n_jobs` or `backend`. Only "kmeans_warm" bins the timesteps one after
+        the other, see `binning_kmeans_warm`.
+
+        Parameters
+        ----------
+        nbins: int
+            Number of bins per timestep
+        method: {"fixed", "kmeans", "kmeans1d", "kmeans_warm"}
+        n_jobs: int
+            Number of workers, `-1` uses all cores
+        backend: {"process", "thread"}
+            Pool used for `n_jobs` > 1. Threads avoid copying the data into the workers, but only
+            run in parallel where numpy/sklearn release the GIL.
+        max_iter, mini_batch:
+            Iterations and mini-batch size of "kmeans_warm", see `binning_kmeans_warm`
+
+        Returns
+        -------
+        Simulation
+            with `bin_data` attribute set to a `Bins` object, which can also be used like a dict
+            of the form `t{i}: {bin{idx}: [...]}`
+        """
+        self.bin_params = {"nbins": nbins, "method": method, "n_jobs": n_jobs, "backend": backend}
+        warm = {"max_iter": max_iter, "mini_batch": mini_batch} if method == "kmeans_warm" else {}
+        self.bin_params.update(warm)
+        self.bins_key = self.edgelist_key = None
+        self.transition_counts = self.transition_first = None
+        if self.cache and self.data_key:
+            key = Cache.key("bins", data=self.data_key, nbins=nbins, method=method, **warm)
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.bin_data = Bins(**cached, data=self.data)
+                self.bins_key = key
+                return self
+
+        n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+        steps = range(self.data.shape[0])
+        progress = lambda it: self.stage.progress(it, len(steps))
+
+        if method == "kmeans_warm":
+            res = self.binning_kmeans_warm(nbins, max_iter, mini_batch, progress)
+        elif n_jobs == 1:
+            res = [self.binning_t(self.data[i], nbins, method) for i in progress(steps)]
+        else:
+            if backend == "process":
+                pool = ProcessPoolExecutor(max_workers=n_jobs)
+            elif backend == "thread":
+                pool = ThreadPoolExecutor(max_workers=n_jobs)
+            else:
+                raise ValueError(f"unknown backend {backend}")
+            with pool:
+                # an empty Simulation is sent to the workers instead of self with all of its data,
+                # workers of memory mapped data read their rows from the file themselves
+                if backend == "process" and isinstance(self.data, np.memmap):
+                    worker, rows = Simulation(cache=False, callback=Callback()).binning_t_file, [(self.data.filename, i) for i in steps]
+                else:
+                    worker, rows = Simulation(cache=False, callback=Callback()).binning_t, self.data
+                res = list(progress(pool.map(worker, rows, [nbins]*len(steps), [method]*len(steps),
+                    chunksize=max(1, len(steps)//(4*n_jobs)))))
+
+        self.bin_data = Bins.from_timesteps(res, data=self.data)
+        if self.cache and self.data_key:
+            self.cache.put(key, lo=self.bin_data.lo, hi=self.bin_data.hi, mean=self.bin_data.mean,
+                median=self.bin_data.median, count=self.bin_data.count)
+            self.bins_key = key
         return self
 
-    def create_edgelist(self, unique_edges=True):
-        res_array = []
-
-        for p in range(len(self.data[0])):
-            res_array.append([])
-            for i in range(len(self.data)):
-                cur_t = self.bin_data[f"t{i}"]
-                for b in cur_t.keys():
-                    tmp = [i for i in cur_t[b] if isinstance(i, float)]
-                    if min(tmp) <= self.data[i][p] <= max(tmp):
-                        # Hier Statistik für Repräsentation der Bins angeben
-                        res_array[p].append(np.mean(tmp))
-                        break
-
-        res_array = np.array(res_array).T.tolist()
-        edgelist = []
-        for i in range(len(res_array)):
-            try:
-                for x, y in zip(res_array[i], res_array[i+1]):
-                    
-                    counter = Counter(zip(res_array[i], res_array[i+1]))
-                    s=0
-                    for k in counter.keys():
-                        if x==k[0]:
-                            s += counter[k]
-                    weight = counter[(float(x),float(y))]/s
-                    edgelist.append({
-                        "parent": x,
-                        "child": y,
-                        "par_value": x,
-                        "ch_value": y,
-                        "prob": weight,
-                        "position_p": (i, x),
-                        "position_c": (i+1, y)})
-            except:
-                pass
+    def assign_bins(self, i, values=None, strict=True):
+        """
+        Assign every path to a bin at timestep `i`
 
-        if unique_edges:
-            a = []
-            for item in edgelist:
-                if item not in a: a.append(item)
-            self.edgelist =  pd.DataFrame.from_dict(a)
-            return self
-        
-        self.edgelist = pd.DataFrame.from_dict(edgelist)
+        A path belongs to the first bin whose range contains its value. Bins of all binning methods
+        do not overlap, so after ordering them by their upper bound the matching bin is the first
+        one whose upper bound is not smaller than the value.
+
+        Parameters
+        ----------
+        i: int
+            Timestep
+        values: np.ndarray, optional
+            Values to assign, defaults to the values of all paths `self.data[i]`
+        strict: bool
+            If False, values outside of all bins are assigned to the next bin above them or
+            the last bin instead of raising an error
+
+        Returns
+        -------
+        np.ndarray
+            Index of the bin of every path in the columns of `bin_data`
+        """
+        values = self.data[i] if values is None else values
+        cols = np.flatnonzero(self.bin_data.count[i] > 0)
+        cols = cols[np.argsort(self.bin_data.hi[i][cols], kind="stable")]
+        lo, hi = self.bin_data.lo[i][cols], self.bin_data.hi[i][cols]
+        if np.any(lo[1:] < hi[:-1]):
+            raise ValueError(f"t{i}: bins must not overlap")
+        idx = np.searchsorted(hi, values, side="left")
+        if not strict:
+            return cols[np.minimum(idx, len(cols)-1)]
+        covered = idx < len(hi)
+        covered[covered] = lo[idx[covered]] <= values[covered]
+        if not covered.all():
+            raise ValueError(f"t{i}: {np.sum(~covered)} values are not covered by any bin")
+        return cols[idx]
+
+    def reset_transitions(self, M, nbins):
+        """
+        Initialize the transition counts of `M` pairs of consecutive timesteps with `nbins` bins each
+        """
+        self.transition_counts = np.zeros((M, nbins*nbins), dtype=np.int64)
+        self.transition_first = np.full((M, nbins*nbins), np.iinfo(np.int64).max, dtype=np.int64)
+
+    def recount_transitions(self):
+        """
+        Transition counts of all paths between the bins of consecutive timesteps, see `count_transitions`
+        """
+        M = len(self.data)-1
+        self.reset_transitions(M, self.bin_data.count.shape[1])
+        prev = self.assign_bins(0)
+        for i in range(M):
+            codes = self.assign_bins(i+1)
+            self.count_transitions(i, prev, codes)
+            prev = codes
+
+    def count_transitions(self, i, codes_p, codes_c, offset=0):
+        """
+        Add the transitions of paths between the bins of timestep `i` and `i+1` to the transition counts
+
+        Parameters
+        ----------
+        i: int
+            Timestep
+        codes_p: np.ndarray
+            Bin of every path at timestep `i`
+        codes_c: np.ndarray
+            Bin of every path at timestep `i+1`
+        offset: int
+            Index of the first of the paths, used to keep track of the first path of every transition
+        """
+        nbins = math.isqrt(self.transition_counts.shape[1])
+        pair = codes_p.astype(np.int64)*nbins + codes_c
+        self.transition_counts[i] += np.bincount(pair, minlength=nbins*nbins)
+        np.minimum.at(self.transition_first[i], pair, np.arange(offset, offset+len(pair)))
+
+    def merge_nodes(self, i, rep):
+        """
+        Nodes and edges between timestep `i` and `i+1` from the transition counts of the bins
+
+        Bins with the same representation are the same node, edges are ordered by the first path
+        taking them.
 
+        Parameters
+        ----------
+        i: int
+            Timestep
+        rep: np.ndarray
+            Representation of every bin, shape `(M+1, nbins)`
+
+        Returns
+        -------
+        tuple
+            `(values_p, values_c, pairs, prob, inv_p, inv_c)` with the sorted node values of both
+            timesteps, the flat pair index `parent*n_c + child` of every edge, its probability and
+            the node of every bin of both timesteps
+        """
+        values_p, inv_p = np.unique(rep[i], return_inverse=True)
+        values_c, inv_c = np.unique(rep[i+1], return_inverse=True)
+        n_c = len(values_c)
+        node_pair = (inv_p[:, None]*n_c + inv_c[None, :]).ravel()
+        node_trans = np.bincount(node_pair, weights=self.transition_counts[i], minlength=len(values_p)*n_c)
+        node_first = np.full(len(values_p)*n_c, np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(node_first, node_pair, self.transition_first[i])
+        pairs = np.flatnonzero(node_trans)
+        pairs = pairs[np.argsort(node_first[pairs], kind="stable")]
+        totals = node_trans.reshape(len(values_p), n_c).sum(axis=1)
+        return values_p, values_c, pairs, node_trans[pairs]/totals[pairs // n_c], inv_p, inv_c
+
+    @instrument("create_edgelist", items=lambda self: len(self.edgelist),
+        nbytes=lambda self: int(self.edgelist.memory_usage().sum()))
+    def create_edgelist(self, unique_edges=True, statistic="mean"):
+        """
+        Create the edgelist of the tree from the binned paths
+
+        Every path is assigned to a bin at every timestep, the bins are represented by the mean
+        (or median) of their elements. Edges between the bins of consecutive timesteps are weighted by the share of
+        paths of the parent bin that move to the child bin.
+
+        Parameters
+        ----------
+        unique_edges: bool
+            If False, one edge for every path and timestep is returned
+        statistic: {"mean", "median"}
+            Statistic used to represent the bins
+
+        Returns
+        -------
+        Simulation
+            with `edgelist` attribute set to a pd.DataFrame with the columns
+            `parent, child, par_value, ch_value, prob, position_p, position_c`
+        """
+        if statistic not in ["mean", "median"]:
+            raise ValueError(f"unknown statistic {statistic}")
+        self.edgelist_params = {"unique_edges": unique_edges, "statistic": statistic}
+        self.edgelist_key = None
+        if self.cache and self.bins_key:
+            key = Cache.key("edgelist", bins=self.bins_key, unique_edges=unique_edges, statistic=statistic)
+            cached = self.cache.get(key)
+            if cached is not None:
+                # the transition counts are needed to `extend` the edgelist
+                self.transition_counts = cached.pop("transition_counts", None)
+                self.transition_first = cached.pop("transition_first", None)
+                self.edgelist = self.edgelist_frame(**cached)
+                self.edgelist_key = key
+                return self
+
+        M = len(self.data)-1
+        rep = getattr(self.bin_data, statistic)
+        self.reset_transitions(M, self.bin_data.count.shape[1])
+        codes = [self.assign_bins(0)]
+        for i in range(M):
+            codes.append(self.assign_bins(i+1))
+            self.count_transitions(i, codes[i], codes[i+1])
+            if unique_edges:
+                codes[i] = None
+
+        edges = []
+        for i in range(M):
+            values_p, values_c, pairs, prob, inv_p, inv_c = self.merge_nodes(i, rep)
+            if not unique_edges:
+                # one edge per path, looked up from the transition of the path
+                lookup = np.zeros(len(values_p)*len(values_c))
+                lookup[pairs] = prob
+                pairs = inv_p[codes[i]].astype(np.int64)*len(values_c) + inv_c[codes[i+1]]
+                prob = lookup[pairs]
+            edges.append((values_p, values_c, pairs, prob))
+
+        self.edgelist = self.build_edgelist(edges)
+        if self.cache and self.bins_key:
+            self.cache.put(key, **{c: self.edgelist[c].to_numpy() for c in ["parent", "child", "prob"]},
+                t=np.array([pos[0] for pos in self.edgelist["position_p"]], dtype=np.int64),
+                transition_counts=self.transition_counts, transition_first=self.transition_first)
+            self.edgelist_key = key
         return self
 
-    def plot(self):
-        plt.plot(self.data, alpha=0.2)
-        plt.show()
+    def build_edgelist(self, edges):
+        """
+        Create the edgelist DataFrame from the transitions of every timestep
+
+        Parameters
+        ----------
+        edges: list
+            One tuple `(values_p, values_c, pairs, prob, ...)` per pair of consecutive timesteps,
+            with the node values of both timesteps, the flat pair index `parent*n_c + child` of
+            every edge and its probability
+
+        Returns
+        -------
+        pd.DataFrame
+        """
+        if len(edges) == 0:
+            return self.edgelist_frame(np.array([]), np.array([]), np.array([]), np.array([], dtype=np.int64))
+        edges = [edge[:4] for edge in edges]
+        return self.edgelist_frame(
+            np.concatenate([values_p[pairs // len(values_c)] for values_p, values_c, pairs, _ in edges]),
+            np.concatenate([values_c[pairs % len(values_c)] for _, values_c, pairs, _ in edges]),
+            np.concatenate([prob for *_, prob in edges]),
+            np.concatenate([np.full(len(pairs), i, dtype=np.int64) for i, (_, _, pairs, _) in enumerate(edges)]))
+
+    def edgelist_frame(self, parent, child, prob, t):
+        """
+        Create the edgelist DataFrame from its columns
+
+        Parameters
+        ----------
+        parent, child: np.ndarray
+            Values of the parent and child node of every edge
+        prob: np.ndarray
+            Probability of every edge
+        t: np.ndarray
+            Timestep of the parent node of every edge
+
+        Returns
+        -------
+        pd.DataFrame
+        """
+        parent, child, t = parent.tolist(), child.tolist(), t.tolist()
+        return pd.DataFrame({
+            "parent": parent,
+            "child": child,
+            "par_value": parent,
+            "ch_value": child,
+            "prob": prob.tolist(),
+            "position_p": list(zip(t, parent)),
+            "position_c": [(i+1, y) for i, y in zip(t, child)]})
+
+    def plot(self, density=None, bins=False, max_paths=1000, resolution=200, file=None, ax=None):
+        """
+        Plot the paths and optionally the bins
+
+        Parameters
+        ----------
+        density: bool, optional
+            Draw the density of the paths as 2-D histogram of timestep and value instead of one
+            line per path. By default used for more than `max_paths` paths.
+        bins: bool
+            Draw the bins of `bin_data` as one `PatchCollection` of rectangles from the smallest to
+            the largest element of every bin
+        max_paths: int
+            Number of paths up to which the paths are drawn as lines
+        resolution: int
+            Number of histogram cells along the value axis
+        file: string, optional
+            Save the plot to this file instead of showing it, e.g. for headless use
+        ax: matplotlib.axes.Axes, optional
+            Axes to draw on, the plot is neither shown nor saved
+        """
+        import matplotlib.pyplot as plt
+        fig = None
+        if ax is None:
+            fig, ax = plt.subplots()
+
+        S = np.asarray(self.data)
+        n_t, I = S.shape
+        if (I > max_paths) if density is None else density:
+            from matplotlib.colors import LogNorm
+            hist, _, y_edges = np.histogram2d(np.repeat(np.arange(n_t), I), S.ravel(),
+                bins=[np.arange(n_t+1)-0.5, resolution])
+            ax.pcolormesh(np.arange(n_t+1)-0.5, y_edges, hist.T, norm=LogNorm(), cmap="Greys")
+        else:
+            ax.plot(S, alpha=0.2)
+
+        if bins and self.bin_data is not None:
+            from matplotlib.collections import PatchCollection
+            from matplotlib.patches import Rectangle
+            t, b = np.nonzero(self.bin_data.count > 0)
+            lo, hi = self.bin_data.lo[t, b], self.bin_data.hi[t, b]
+            rects = [Rectangle((ti-0.4, l), 0.8, h-l) for ti, l, h in zip(t, lo, hi)]
+            ax.add_collection(PatchCollection(rects, facecolors=plt.cm.tab10(b % 10), alpha=0.4, edgecolor="none"))
+        ax.set_xlabel("Timestep")
+        ax.set_ylabel("Index Value")
+
+        if fig is None:
+            return
+        if file is not None:
+            fig.savefig(file)
+            plt.close(fig)
+        else:
+            plt.show()
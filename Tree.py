@@ -1,17 +1,19 @@
 import numpy as np
 import pandas as pd
-import networkx as nx
-import matplotlib.pyplot as plt
-from Simulation import *
+from Lattice import Lattice
+from Cache import Cache
+from Instrumentation import Callback, instrument
 import re
+import os
+import json
 
 class Node():
 
-    def __init__(self, name, value, t=None, parents=[]):
+    def __init__(self, name, value, t=None, parents=None):
         self.name = name
         self.value = value
         self.t = self.set_t(t)
-        self.parents = parents
+        self.parents = [] if parents is None else list(parents)
         #children dict of form {node: probability}
         self.children = {}
         self.ev = ""
@@ -54,9 +56,8 @@ class Node():
         """
 
         for parent, prob in kwargs:
-            self.parents=list(self.parents)
-            self.parents.append(parent)
-            self.parents = list(set(self.parents))
+            if parent not in self.parents:
+                self.parents.append(parent)
             parent.children[self] = prob
 
         return self
@@ -95,9 +96,32 @@ class Node():
         
 class Tree():
 
-    def __init__(self, nodes=[]):
-        self.nodes = self.append_node()
+    # files of a saved tree: the arrays of the lattice (see `Lattice.to_arrays`) and the option values
+    columns = ["names", "values", "t", "data", "indices", "indptr", "ev"]
+
+    def __init__(self, nodes=[], callback=None):
+        """
+        Parameters
+        ----------
+        nodes: list
+            Names of nodes
+        callback: Callback, optional
+            Receives the metrics of `from_S`, `from_edgelist` and `calc_option_value`, see `Instrumentation`
+        """
+        self.callback = Callback() if callback is None else callback
+        self.nodes = list(nodes)
+        self.lattice = None
+        self.edgelist = None
         self.option_params = None
+        self.option_price = None
+        # option value of every node of the lattice, set by `calc_option_value`
+        self.ev = None
+
+    def lattice_nbytes(self):
+        """
+        Size of the arrays of the lattice in bytes
+        """
+        return sum(a.nbytes for a in self.lattice.to_arrays().values())
 
     def append_node(self, *kwargs):
         """
@@ -105,19 +129,29 @@ class Tree():
 
         Parameters
         ----------
-        *kwargs: Node object
-            `Node` object to append to the tree.
+        *kwargs: Node name
+            Name of a node of the tree's lattice to append to the tree.
         """
         for n in kwargs:
-            globals()[n].tree = self
             self.nodes.append(n)
-        try:
-            isinstance(self.nodes, list)
-        except Exception as e:
-            print(e)
-            return []
         return self
 
+    def from_lattice(self, lattice):
+        """
+        Create a Tree from a `Lattice` object.
+
+        Parameters
+        ----------
+        lattice: Lattice object
+        """
+        self.lattice = lattice
+        self.nodes = []
+        self.ev = None
+        self.option_params = None
+        self.append_node(*lattice.names.tolist())
+        return self
+
+    @instrument("Tree.from_edgelist", items=lambda self: len(self.lattice.names), nbytes=lambda self: self.lattice_nbytes())
     def from_edgelist(self, file):
         """
         Create a Tree from a .csv file.
@@ -131,23 +165,10 @@ class Tree():
             `b0t0,40,b0t1,34.72,0.4461`
         
         """
-        self.nodes = []
         self.edgelist = pd.read_csv(file)
-        all_nodes = set(pd.concat([self.edgelist["parent"], self.edgelist["child"]], axis=0))
-
-        for idx, row in self.edgelist.iterrows():
-            globals()[row["parent"]] = Node(row["parent"], row["par_value"])
-            globals()[row["child"]] = Node(row["child"], row["ch_value"])
-
-        for idx, row in self.edgelist.iterrows():
-            # TODO: Get globals() out!
-            globals()[row["child"]].add_parent((globals()[row["parent"]], row["prob"]))
-
-        for node in all_nodes:
-            self.append_node(node)
-
-        return self
+        return self.from_lattice(Lattice.from_edgelist(self.edgelist))
 
+    @instrument("Tree.from_S", items=lambda self: len(self.lattice.names), nbytes=lambda self: self.lattice_nbytes())
     def from_S(self, S):
         """
         Create a Tree from a `Simulation` object.
@@ -158,46 +179,121 @@ class Tree():
             Simulation object on which `generate` and `binning` was executed
 
         """
-        self.nodes = [] #clear old node list
         self.edgelist = S.edgelist # get the edgelist attribute of the Simulation object
 
-        # get a list of all nodes in S
-        all_nodes = set(pd.concat([self.edgelist["parent"], self.edgelist["child"]], axis=0))
+        # reuse the lattice of a cached edgelist
+        cache = getattr(S, "cache", None)
+        if cache and S.edgelist_key:
+            key = Cache.key("lattice", edgelist=S.edgelist_key)
+            cached = cache.get(key)
+            if cached is not None:
+                return self.from_lattice(Lattice.from_arrays(**cached))
+            lattice = Lattice.from_edgelist(self.edgelist)
+            cache.put(key, **lattice.to_arrays())
+            return self.from_lattice(lattice)
 
-        # create node for every parent and child in S.edgelist
-        for idx, row in self.edgelist.iterrows():
-            globals()[row["parent"]] = Node(row["parent"], row["par_value"], row["position_p"][0])
-            globals()[row["child"]] = Node(row["child"], row["ch_value"], row["position_c"][0])
+        return self.from_lattice(Lattice.from_edgelist(self.edgelist))
 
-        # add the parents to each node
-        for _, row in self.edgelist.iterrows():
-            # TODO: Get globals() out!
-            globals()[row["child"]].add_parent((globals()[row["parent"]], row["prob"]))
+    def save(self, path):
+        """
+        Save the tree to a directory with one `.npy` file per column.
 
-        # append all nodes to the tree
-        for node in all_nodes:
-            self.append_node(node)
+        Besides the lattice, the option values of the last `calc_option_value` are saved. Only the
+        files of `columns` and `tree.json` are written or replaced, other files in the directory
+        are kept.
 
+        Parameters
+        ----------
+        path: string
+            Directory, created if it does not exist
+        """
+        os.makedirs(path, exist_ok=True)
+        arrays = self.lattice.to_arrays()
+        if self.ev is not None:
+            arrays["ev"] = self.ev
+        for name in self.columns:
+            file = os.path.join(path, f"{name}.npy")
+            if name not in arrays and os.path.exists(file):
+                os.remove(file)
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), array)
+        with open(os.path.join(path, "tree.json"), "w") as f:
+            json.dump({"option_params": self.option_params,
+                "option_price": None if self.option_price is None else float(self.option_price)}, f)
         return self
 
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """
+        Load a tree saved by `save`.
+
+        The columns are memory mapped by default, so loading does not read the whole lattice.
+
+        Parameters
+        ----------
+        path: string
+            Directory written by `save`
+        mmap_mode: {"r", "r+", "c", None}
+            Passed to `np.load`, None reads the columns into memory
+
+        Returns
+        -------
+        Tree
+        """
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in cls.columns if os.path.exists(os.path.join(path, f"{name}.npy"))}
+        ev = arrays.pop("ev", None)
+        tree = cls().from_lattice(Lattice.from_arrays(**arrays))
+        with open(os.path.join(path, "tree.json")) as f:
+            meta = json.load(f)
+        tree.ev = ev
+        tree.option_params = meta["option_params"]
+        tree.option_price = meta["option_price"]
+        return tree
+
+    def get_node(self, name):
+        """
+        Create a `Node` object for inspection of a node of the tree.
+
+        The parents and children of the returned node are `Node` objects without
+        parents and children of their own.
+
+        Parameters
+        ----------
+        name:
+            Name of the node
+
+        Returns
+        -------
+        Node
+        """
+        lattice = self.lattice
+        i = lattice.index.get_loc(name)
+        node = self._make_node(i)
+        for j, prob in lattice.children(i).items():
+            node.children[self._make_node(j)] = prob
+        node.parents = [self._make_node(j) for j in lattice.parents(i)]
+        return node
+
+    def _make_node(self, i):
+        node = Node(self.lattice.names[i], self.lattice.values[i])
+        node.t = int(self.lattice.t[i])
+        if self.ev is not None:
+            node.ev = self.ev[i]
+        return node
+
     def get_leafs(self):
         """
         Helper method to get the leafs of the Tree.
         
-        Used to find the starting point of the `calc_options_value` method.
-        
         Returns
         -------
         list
             List of leaf nodes
         """
+        return self.lattice.names[self.lattice.n_children() == 0].tolist()
 
-        leafs = []
-        for node in self.nodes:
-            if len(globals()[node].children) == 0:
-                leafs.append(node)
-        return leafs
-
+    @instrument("calc_option_value", items=lambda self: len(self.lattice.names), nbytes=lambda self: self.ev.nbytes)
     def calc_option_value(self, strike, discount, type="call", opt="european"):
         """
         Calculation of option values for all nodes in the tree.
@@ -213,69 +309,156 @@ class Tree():
         opt: {"european", "american"}
         """
         self.option_params = {"Strike Price": strike, "Discount Rate": discount, "Type": type, "Option": opt}
-        #get the leafs to start calculation
-        parent_list = self.get_leafs()
-
-        # while the parent list is not empty...
-        while len(parent_list) != 0:
-            tmp_parent_list = [] # initialize list for parents of currently calculating nodes
-            for node in parent_list:
-                globals()[node].get_option_value(strike, discount, opt, type)
-                tmp_ev = globals()[node].ev
-                tmp_parent_list.extend([i.name for i in globals()[node].parents])
-            parent_list=list(set(tmp_parent_list)) # set the previous timesteps nodes as the new parent_list
-        self.option_price = tmp_ev
+        self.ev = self.lattice.backward_induction(strike, discount, type, opt)[:, 0]
+        self.option_price = self.ev[self.lattice.root]
         return self
 
-    def plot(self):
+    def calc_option_values(self, strike, discount, type="call", opt="european"):
         """
-        Generate and show the plot of the Tree() object using its `nodes` attribute.
+        Calculation of the option prices of many contracts in one backward pass.
+
+        All arguments are broadcast against each other, e.g. an array of strikes with
+        a single discount factor, type and option. The values of the nodes are not stored
+        on the tree.
+
+        Parameters
+        ----------
+        self: Tree Object
+        strike: float or array-like
+            Strike prices of the options
+        discount: float or array-like
+            discount factors
+        type: {"call", "put"} or array-like
+        opt: {"european", "american"} or array-like
+
+        Returns
+        -------
+        pd.DataFrame
+            with the columns `strike, discount, type, opt, price`, one row per contract
+        """
+        strike, discount, type, opt = Lattice.contracts(strike, discount, type, opt)
+        ev = self.lattice.backward_induction(strike, discount, type, opt, all_nodes=False)
+        return pd.DataFrame({"strike": strike, "discount": discount, "type": type, "opt": opt, "price": ev[self.lattice.root]})
+
+    def plot(self, fast=None, label_threshold=200, file=None, ax=None):
+        """
+        Generate and show the plot of the Tree() object using its lattice.
 
         If `calc_option_value()` was executed on the tree, it also shows the option value for each node.
 
+        Parameters
+        ----------
+        fast: bool, optional
+            Draw all edges as a single `LineCollection` instead of a networkx graph, the line width
+            shows the probability. By default used for trees with more than `label_threshold` nodes.
+        label_threshold: int
+            Node and edge labels are only drawn for trees with at most this many nodes
+        file: string, optional
+            Save the plot to this file instead of showing it, e.g. for headless use
+        ax: matplotlib.axes.Axes, optional
+            Axes to draw on, the plot is neither shown nor saved
+
         Returns
         -------
             None
         """
+        import matplotlib.pyplot as plt
+        lattice = self.lattice
+        ev = self.ev if self.ev is not None else np.full(len(lattice.names), np.nan)
+        labels = len(lattice.names) <= label_threshold
+        fast = not labels if fast is None else fast
+        fig = None
+        if ax is None:
+            fig, ax = plt.subplots()
+
+        if fast:
+            self.plot_fast(ax, ev, labels)
+        else:
+            self.plot_graph(ax, ev)
+
+        # if there theres an option calculated on the tree, draw annotation with information
+        # about the option
+        if self.option_params is not None:
+            annotation_text_x = max(lattice.values)-max(lattice.values)*0.05
+            ax.text(0, annotation_text_x,
+                "\n".join([f"{key}: {value}" for key, value in self.option_params.items()])
+                )
+
+        if fig is None:
+            return
+        if file is not None:
+            fig.savefig(file)
+            plt.close(fig)
+        else:
+            plt.show()
+
+        return
+
+    def edges(self):
+        """
+        Parent id, child id and probability of every edge of the lattice
+        """
+        lattice = self.lattice
+        P = [P.tocoo() for P in lattice.transitions]
+        return (np.concatenate([p.row+lattice.offsets[t] for t, p in enumerate(P)] + [np.array([], dtype=np.int64)]).astype(np.int64),
+            np.concatenate([p.col+lattice.offsets[t+1] for t, p in enumerate(P)] + [np.array([], dtype=np.int64)]).astype(np.int64),
+            np.concatenate([p.data for p in P] + [np.array([])]))
+
+    def plot_fast(self, ax, ev, labels):
+        """
+        Draw the edges as one `LineCollection`, labels only if `labels`
+        """
+        from matplotlib.collections import LineCollection
+        lattice = self.lattice
+        p, c, prob = self.edges()
+        x, y = lattice.t, lattice.values
+        segments = np.stack([np.column_stack([x[p], y[p]]), np.column_stack([x[c], y[c]])], axis=1)
+        ax.add_collection(LineCollection(segments, linewidths=0.2+2*prob, colors="black", alpha=0.6))
+        ax.scatter(x, y, s=4, color="black", zorder=2)
+        ax.autoscale()
+        if labels:
+            for xi, yi, v, e in zip(x, y, y, ev):
+                ax.text(xi, yi, f"{round(v, 2)}\n{round(e, 2)}", ha="center", va="center",
+                    bbox=dict(facecolor="white"))
+            for xp, yp, xc, yc, pr in zip(x[p], y[p], x[c], y[c], prob):
+                ax.text(xp+0.3*(xc-xp), yp+0.3*(yc-yp), round(pr, 2), ha="center", va="center", fontsize="small")
+        ax.set_xlabel("Timestep")
+
+    def plot_graph(self, ax, ev):
+        """
+        Draw the tree as networkx graph with node and edge labels
+        """
+        import networkx as nx
+        lattice = self.lattice
 
         # initialize Graph object
         G=nx.Graph()
-        
-        for node in self.nodes:
-            G.add_node(node, pos=(globals()[node].t, globals()[node].value), label=f"{round(globals()[node].value, 2)}\n{round(globals()[node].ev, 2)}")
-            for child in globals()[node].children:
-                G.add_edge(node, child.name, label=round(globals()[node].children[child], 2))
-        
+
+        for i, node in enumerate(lattice.names):
+            G.add_node(node, pos=(lattice.t[i], lattice.values[i]), label=f"{round(lattice.values[i], 2)}\n{round(ev[i], 2)}")
+        for p, c, prob in zip(*self.edges()):
+            G.add_edge(lattice.names[p], lattice.names[c], label=round(prob, 2))
+
         # Draw graph without nodes and labels
         nx.draw(G,
             pos=nx.get_node_attributes(G, 'pos'),
+            ax=ax,
             with_labels=False,
             node_size=0)
 
         # Draw edge labels
         nx.draw_networkx_edge_labels(G,
             pos=nx.get_node_attributes(G, 'pos'),
+            ax=ax,
             label_pos=0.3,
             edge_labels=nx.get_edge_attributes(G,'label'))
-        
+
         # Draw Node labels with a bounding box
         nx.draw_networkx_labels(G,
             pos=nx.get_node_attributes(G, 'pos'),
+            ax=ax,
             bbox=dict(facecolor="white"),
             labels=nx.get_node_attributes(G, 'label'))
-        
-        # if there theres an option calculated on the tree, draw annotation with information
-        # about the option
-        if self.option_params is not None:
-            annotation_text_x = max([globals()[node].value for node in self.nodes])-\
-                max([globals()[node].value for node in self.nodes])*0.05
-            plt.text(0, annotation_text_x,
-                "\n".join([f"{key}: {value}" for key, value in self.option_params.items()])
-                )
-        
-        plt.show()
-        
-        return
- 
+
     def __str__(self):
         return(str(self.edgelist))
@@ -1,5 +1,5 @@
-from Simulation import *
-from Tree import *
+from Simulation import Simulation
+from Tree import Tree
 
 # Simulation der Werte mit den Standardparametern
 
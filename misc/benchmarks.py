@@ -0,0 +1,296 @@
+import os
+import sys
+import time
+import json
+import argparse
+import platform
+import tempfile
+import itertools
+import subprocess
+import tracemalloc
+import numpy as np
+
+# headless: no window is opened even if a plot function is called
+os.environ.setdefault("MPLBACKEND", "Agg")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Simulation import Simulation
+from Tree import Tree
+from Instrumentation import Callback
+
+def timeit(func, repeat=1):
+    """
+    Best wall time of `repeat` calls of `func` in seconds
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter()-start)
+    return best
+
+def bench_binning(M=252, I=100000, nbins=4, method="fixed", n_jobs=(1, 2, 4, 8), backend="process", repeat=1):
+    """
+    Scaling of `Simulation.binning` with the number of workers
+
+    Parameters
+    ----------
+    M, I: int
+        Timesteps and paths of the simulation
+    nbins: int
+        Number of bins
+    method: {"fixed", "kmeans"}
+    n_jobs: iterable
+        Worker counts to measure
+    backend: {"process", "thread"}
+    repeat: int
+        Number of repetitions, the best time is reported
+
+    Returns
+    -------
+    list
+        dicts with the keys `n_jobs, seconds, speedup`
+    """
+    S = Simulation(cache=False, callback=Callback()).generate(M=M, I=I, seed=0)
+    res = []
+    for n in n_jobs:
+        seconds = timeit(lambda: S.binning(nbins=nbins, method=method, n_jobs=n, backend=backend), repeat)
+        res.append({"n_jobs": n, "seconds": seconds, "speedup": res[0]["seconds"]/seconds if res else 1.0})
+    return res
+
+def bench_kmeans(M=20, I=100000, nbins=(2, 4, 8, 16), repeat=1):
+    """
+    `binning` with `method="kmeans1d"` against the sklearn based `method="kmeans"`
+
+    Parameters
+    ----------
+    M, I: int
+        Timesteps and paths of the simulation
+    nbins: iterable
+        Numbers of bins to measure
+    repeat: int
+        Number of repetitions, the best time is reported
+
+    Returns
+    -------
+    list
+        dicts with the keys `nbins, kmeans, kmeans1d, speedup, inertia_kmeans, inertia_kmeans1d`,
+        the inertia is the within bin sum of squares summed over all timesteps. `speedup` is the
+        time of "kmeans" divided by the time of "kmeans1d", below 1 where "kmeans1d" is slower,
+        which is the case from about 4 bins on for 100000 paths.
+    """
+    S = Simulation(cache=False, callback=Callback()).generate(M=M, I=I, seed=0)
+
+    def inertia():
+        return sum(((np.asarray(b)-np.mean(b))**2).sum() for t in S.bin_data.values() for b in t.values())
+
+    # untimed first call of every method, which imports sklearn
+    for method in ["kmeans", "kmeans1d"]:
+        S.binning(nbins=2, method=method)
+    res = []
+    for n in nbins:
+        row = {"nbins": n}
+        for method in ["kmeans", "kmeans1d"]:
+            row[method] = timeit(lambda: S.binning(nbins=n, method=method), repeat)
+            row[f"inertia_{method}"] = inertia()
+        row["speedup"] = row["kmeans"]/row["kmeans1d"]
+        res.append(row)
+    return res
+
+def peak_memory(func):
+    """
+    Peak memory allocated by a call of `func` in bytes, traced by `tracemalloc`
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_pipeline(I=(1000, 10000), M=(20,), nbins=(4, 16), method=("fixed", "kmeans"), repeat=3, memory=True):
+    """
+    Wall time and peak memory of every stage of the pipeline simulate -> bin -> lattice -> price
+
+    The stages `generate, binning, create_edgelist, Tree.from_S, Tree.from_edgelist,
+    calc_option_value` are measured for every combination of the parameters. Times are the best
+    of `repeat` runs, the peak memory is measured in a separate run because tracing slows down
+    the stages. Caching is disabled.
+
+    Parameters
+    ----------
+    I, M, nbins: iterable
+        Paths, timesteps and numbers of bins to sweep
+    method: iterable
+        Binning methods to sweep
+    repeat: int
+        Number of repetitions, the best time is reported
+    memory: bool
+        Whether to measure the peak memory
+
+    Returns
+    -------
+    list
+        dicts with the keys `I, M, nbins, method, stage, seconds, peak_bytes, items`
+    """
+    edgelist_file = os.path.join(tempfile.mkdtemp(), "edgelist.csv")
+    res = []
+    for n_paths, n_steps, n, meth in itertools.product(I, M, nbins, method):
+        state = {}
+
+        def generate():
+            state["S"] = Simulation(cache=False, callback=Callback()).generate(M=n_steps, I=n_paths, seed=0)
+
+        def binning():
+            state["S"].binning(nbins=n, method=meth)
+
+        def create_edgelist():
+            state["S"].create_edgelist()
+
+        def from_S():
+            state["tree"] = Tree().from_S(state["S"])
+
+        def from_edgelist():
+            Tree().from_edgelist(edgelist_file)
+
+        def calc_option_value():
+            state["tree"].calc_option_value(100, np.exp(-0.05/n_steps), "call")
+
+        stages = [("generate", generate), ("binning", binning), ("create_edgelist", create_edgelist),
+            ("Tree.from_S", from_S), ("Tree.from_edgelist", from_edgelist), ("calc_option_value", calc_option_value)]
+        for stage, func in stages:
+            row = {"I": n_paths, "M": n_steps, "nbins": n, "method": meth, "stage": stage,
+                "seconds": timeit(func, repeat), "peak_bytes": peak_memory(func) if memory else None}
+            res.append(row)
+            if stage == "create_edgelist":
+                # input of Tree.from_edgelist, written outside of the measured stages with the
+                # same columns as `edgelist.csv`
+                state["S"].edgelist[["parent", "par_value", "child", "ch_value", "prob"]].to_csv(edgelist_file, index=False)
+        items = {"generate": n_paths*(n_steps+1), "binning": int(np.sum(state["S"].bin_data.count > 0)),
+            "create_edgelist": len(state["S"].edgelist), "Tree.from_S": len(state["tree"].lattice.names),
+            "Tree.from_edgelist": len(state["S"].edgelist), "calc_option_value": len(state["tree"].lattice.names)}
+        for row in res[-len(stages):]:
+            row["items"] = items[row["stage"]]
+    return res
+
+def bench_import(modules=("Lattice", "Tree"), budget=1.0, heavy=("sklearn", "matplotlib", "networkx", "tqdm"), repeat=3):
+    """
+    Import time of the pricing modules in a fresh interpreter
+
+    Pricing-only workers load a lattice and price it, they must not pay for the plotting and
+    clustering dependencies, which are imported on first use.
+
+    Parameters
+    ----------
+    modules: iterable
+        Modules imported together
+    budget: float
+        Allowed import time in seconds
+    heavy: iterable
+        Packages which must not be imported
+    repeat: int
+        Number of fresh interpreters, the best time is reported
+
+    Returns
+    -------
+    dict
+        with the keys `seconds, budget, loaded, ok`, `loaded` are the heavy packages that were imported
+    """
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    code = (f"import sys, time, json; sys.path.insert(0, {root!r}); start = time.perf_counter()\n"
+        + "".join(f"import {m}\n" for m in modules)
+        + f"print(json.dumps([time.perf_counter()-start, [m for m in {list(heavy)!r} if m in sys.modules]]))")
+    seconds, loaded = np.inf, []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        t, loaded = json.loads(out)
+        seconds = min(seconds, t)
+    return {"seconds": seconds, "budget": budget, "loaded": loaded, "ok": seconds <= budget and not loaded}
+
+def environment():
+    """
+    Description of the code and machine the benchmarks ran on
+    """
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    try:
+        commit = subprocess.run(["git", "-C", root, "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {"commit": commit or None, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+        "numpy": np.__version__, "machine": platform.machine(), "cores": os.cpu_count()}
+
+def compare(old, new, threshold=1.1):
+    """
+    Stages which got slower between two result files of `pipeline --json`
+
+    Parameters
+    ----------
+    old, new: string
+        Paths of the json files
+    threshold: float
+        Ratio of the times above which a stage counts as regression
+
+    Returns
+    -------
+    list
+        dicts with the keys `I, M, nbins, method, stage, old, new, ratio` of the regressions
+    """
+    keys = ["I", "M", "nbins", "method", "stage"]
+    with open(old) as f:
+        before = {tuple(row[k] for k in keys): row["seconds"] for row in json.load(f)["results"]}
+    with open(new) as f:
+        after = json.load(f)["results"]
+    res = []
+    for row in after:
+        key = tuple(row[k] for k in keys)
+        if key in before and row["seconds"] > threshold*before[key]:
+            res.append({**{k: row[k] for k in keys}, "old": before[key], "new": row["seconds"],
+                "ratio": row["seconds"]/before[key]})
+    return res
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the binning methods")
+    parser.add_argument("benchmark", choices=["binning", "kmeans", "pipeline", "compare", "import"])
+    parser.add_argument("files", nargs="*", help="old and new json file for compare")
+    parser.add_argument("--M", type=int, nargs="+", default=[252])
+    parser.add_argument("--I", type=int, nargs="+", default=[100000])
+    parser.add_argument("--nbins", type=int, nargs="+", default=[4])
+    parser.add_argument("--method", nargs="+", default=["fixed"])
+    parser.add_argument("--backend", default="process")
+    parser.add_argument("--n-jobs", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true", help="skip the peak memory measurement")
+    parser.add_argument("--json", help="write the results of pipeline to this file")
+    parser.add_argument("--threshold", type=float, default=1.1)
+    parser.add_argument("--budget", type=float, default=1.0, help="import time budget in seconds")
+    args = parser.parse_args()
+
+    if args.benchmark == "binning":
+        print(f"binning M={args.M[0]} I={args.I[0]} nbins={args.nbins[0]} method={args.method[0]} backend={args.backend} cores={os.cpu_count()}")
+        for row in bench_binning(args.M[0], args.I[0], args.nbins[0], args.method[0], args.n_jobs, args.backend):
+            print(f"n_jobs={row['n_jobs']:>3}  {row['seconds']:8.3f}s  speedup {row['speedup']:5.2f}")
+    elif args.benchmark == "kmeans":
+        print(f"kmeans vs kmeans1d M={args.M[0]} I={args.I[0]}")
+        for row in bench_kmeans(args.M[0], args.I[0], args.nbins):
+            print(f"nbins={row['nbins']:>3}  kmeans {row['kmeans']:8.3f}s  kmeans1d {row['kmeans1d']:8.3f}s  "
+                f"speedup {row['speedup']:5.2f}  inertia {row['inertia_kmeans']:.6g} / {row['inertia_kmeans1d']:.6g}")
+    elif args.benchmark == "pipeline":
+        res = bench_pipeline(args.I, args.M, args.nbins, args.method, args.repeat, not args.no_memory)
+        for row in res:
+            memory = "" if row["peak_bytes"] is None else f"  {row['peak_bytes']/2**20:9.2f} MiB"
+            print(f"I={row['I']:>8} M={row['M']:>4} nbins={row['nbins']:>3} {row['method']:>8}  {row['stage']:<18}"
+                f"{row['seconds']:9.4f}s{memory}  items {row['items']}")
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"environment": environment(), "results": res}, f, indent=1)
+    elif args.benchmark == "compare":
+        if len(args.files) != 2:
+            parser.error("compare needs the old and the new json file")
+        regressions = compare(*args.files, threshold=args.threshold)
+        for row in regressions:
+            print(f"I={row['I']:>8} M={row['M']:>4} nbins={row['nbins']:>3} {row['method']:>8}  {row['stage']:<18}"
+                f"{row['old']:9.4f}s -> {row['new']:9.4f}s  x{row['ratio']:.2f}")
+        sys.exit(1 if regressions else 0)
+    elif args.benchmark == "import":
+        res = bench_import(budget=args.budget)
+        print(f"import Lattice, Tree  {res['seconds']:.3f}s  budget {res['budget']:.3f}s  heavy modules {res['loaded'] or 'none'}")
+        sys.exit(0 if res["ok"] else 1)
@@ -1,3 +1,5 @@
+import os
+import sys
 import math
 import numpy as np
 from itertools import zip_longest, chain
@@ -7,6 +9,9 @@ from collections import defaultdict
 from sklearn.cluster import KMeans
 from visualizing import draw_graph, draw_overlap, draw_diffs
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Simulation import kmeans_1d
+
 np.random.seed(42)
 
 def simulate_paths(S0 = 100., K = 200., T = 1.0, r = 0.05, sigma = 0.2, M = 5, I = 100):
@@ -43,6 +48,12 @@ def binning_t_kmeans(S_t, n=4):
             res[f"bin{i}"]=[100]
     return res
 
+def binning_t_kmeans1d(S_t, n=4):
+    #bin{idx}: [1,2,3,...], optimal and deterministic
+    sorted = np.sort(S_t)
+    starts = kmeans_1d(sorted, n)
+    return {f"bin{idx}": list(item) for idx, item in enumerate(np.split(sorted, starts[1:]))}
+
 def binning_S(S, nbins=4, method="kmeans"):
     n = int(len(S[0])/nbins)
     res_dict = dict()
@@ -50,6 +61,8 @@ def binning_S(S, nbins=4, method="kmeans"):
     for i in tqdm(range(S.shape[0]), desc=f"binning using {method}"):
         if method=="kmeans":
             res_dict[f"t{i}"] = binning_t_kmeans(S[i], n=nbins)
+        elif method=="kmeans1d":
+            res_dict[f"t{i}"] = binning_t_kmeans1d(S[i], n=nbins)
         elif method=="fixed":
             res_dict[f"t{i}"] = binning_t_fs(S[i], n=n)
     return res_dict
@@ -0,0 +1,164 @@
+import os
+import sys
+import time
+import warnings
+import argparse
+import itertools
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Simulation import Simulation
+from Tree import Tree
+from Instrumentation import Callback
+
+def run(seed, nbins, method, params, strikes, type="call", opt="european"):
+    """
+    Simulation, binning and pricing of one run of a study
+
+    Parameters
+    ----------
+    seed: int
+    nbins: int
+    method: string
+        Binning method
+    params: dict
+        Parameters of `Simulation.generate` besides the seed
+    strikes: list
+        Strike prices of the options
+    type, opt:
+        see `Tree.calc_option_value`
+
+    Returns
+    -------
+    dict
+        with the keys `seed, nbins, method, seconds, lo, hi, mean, count` (the compact bin arrays)
+        and `price` (one price per strike)
+    """
+    start = time.perf_counter()
+    S = Simulation(cache=False, callback=Callback()).generate(**params, seed=seed)
+    S.binning(nbins=nbins, method=method).create_edgelist()
+    p = {"T": 1.0, "r": 0.05, "M": 20, **params}
+    prices = Tree().from_S(S).calc_option_values(strikes, np.exp(-p["r"]*p["T"]/p["M"]), type, opt)["price"].to_numpy()
+    bins = S.bin_data
+    return {"seed": seed, "nbins": nbins, "method": method, "seconds": time.perf_counter()-start,
+        "lo": bins.lo, "hi": bins.hi, "mean": bins.mean, "count": bins.count, "price": prices}
+
+def bin_diffs(lo1, hi1, lo2, hi2):
+    """
+    `|hi1-hi2| + |lo1-lo2|` of every timestep and bin, like `get_diffs` in `simulating.py`,
+    for arrays of any shape. Bins missing in one of the binnings give NaN.
+    """
+    n = min(lo1.shape[-1], lo2.shape[-1])
+    return np.abs(hi1[..., :n]-hi2[..., :n]) + np.abs(lo1[..., :n]-lo2[..., :n])
+
+def study(seeds=range(100), nbins=(4,), methods=("fixed", "kmeans1d"), reference=None, params=None,
+        strikes=(100.,), type="call", opt="european", n_jobs=1):
+    """
+    Stability study of binning methods over many seeds
+
+    All combinations of seed, number of bins and method are run on a process pool. The bin
+    arrays of all runs of a number of bins are stacked, the metrics are computed on the stacked
+    arrays.
+
+    Parameters
+    ----------
+    seeds: iterable
+    nbins: iterable
+    methods: iterable
+        Binning methods
+    reference: string, optional
+        Method the bin boundaries are compared with, defaults to the first method
+    params: dict, optional
+        Parameters of `Simulation.generate`, defaults to `M=20, I=1000`
+    strikes: iterable
+        Strike prices
+    type, opt:
+        see `Tree.calc_option_value`
+    n_jobs: int
+        Number of processes, -1 for all cores
+
+    Returns
+    -------
+    tuple
+        `(runs, summary)` as pd.DataFrame. `runs` has one row per seed, number of bins, method and
+        strike with the columns `seed, nbins, method, strike, price, seconds, diff_mean, diff_max`,
+        the differences of the bin boundaries to the reference method with the same seed.
+        `summary` has one row per number of bins, method and strike with the mean and standard
+        deviation of the price over the seeds, `boundary_std` (standard deviation of the bin
+        boundaries over the seeds, averaged over timesteps and bins) and the mean differences.
+    """
+    params = {"M": 20, "I": 1000, **(params or {})}
+    seeds, nbins, methods, strikes = list(seeds), list(nbins), list(methods), list(strikes)
+    reference = methods[0] if reference is None else reference
+    if reference not in methods:
+        methods.append(reference)
+    jobs = list(itertools.product(seeds, nbins, methods))
+    n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+
+    args = [[a[i] for a in jobs] for i in range(3)] + [[params]*len(jobs), [strikes]*len(jobs), [type]*len(jobs), [opt]*len(jobs)]
+    if n_jobs == 1:
+        res = list(map(run, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            res = list(pool.map(run, *args, chunksize=max(1, len(jobs)//(4*n_jobs))))
+
+    runs, summary = [], []
+    for n in nbins:
+        # arrays of shape (methods, seeds, timesteps, bins)
+        stack = {key: np.stack([np.stack([r[key] for r in res if r["nbins"] == n and r["method"] == m]) for m in methods])
+            for key in ["lo", "hi", "price", "seconds"]}
+        ref = methods.index(reference)
+        diffs = bin_diffs(stack["lo"], stack["hi"], stack["lo"][ref], stack["hi"][ref])
+        with warnings.catch_warnings():
+            # all-NaN slices of empty bins
+            warnings.simplefilter("ignore", RuntimeWarning)
+            diff_mean = np.nanmean(diffs, axis=(2, 3))
+            diff_max = np.nanmax(diffs, axis=(2, 3))
+            boundary_std = np.nanmean((np.nanstd(stack["lo"], axis=1) + np.nanstd(stack["hi"], axis=1))/2, axis=(1, 2))
+
+        n_m, n_s, n_k = stack["price"].shape
+        runs.append(pd.DataFrame({
+            "seed": np.tile(np.repeat(seeds, n_k), n_m),
+            "nbins": n,
+            "method": np.repeat(methods, n_s*n_k),
+            "strike": np.tile(strikes, n_m*n_s),
+            "price": stack["price"].ravel(),
+            "seconds": np.repeat(stack["seconds"].ravel(), n_k),
+            "diff_mean": np.repeat(diff_mean.ravel(), n_k),
+            "diff_max": np.repeat(diff_max.ravel(), n_k)}))
+        summary.append(pd.DataFrame({
+            "nbins": n,
+            "method": np.repeat(methods, n_k),
+            "strike": np.tile(strikes, n_m),
+            "price_mean": stack["price"].mean(axis=1).ravel(),
+            "price_std": stack["price"].std(axis=1, ddof=1).ravel() if n_s > 1 else np.nan,
+            "boundary_std": np.repeat(boundary_std, n_k),
+            "diff_mean": np.repeat(diff_mean.mean(axis=1), n_k),
+            "seconds": np.repeat(stack["seconds"].mean(axis=1), n_k)}))
+    return pd.concat(runs, ignore_index=True), pd.concat(summary, ignore_index=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stability study of the binning methods over many seeds")
+    parser.add_argument("--seeds", type=int, default=100, help="number of seeds")
+    parser.add_argument("--nbins", type=int, nargs="+", default=[4])
+    parser.add_argument("--methods", nargs="+", default=["fixed", "kmeans1d"])
+    parser.add_argument("--reference")
+    parser.add_argument("--M", type=int, default=20)
+    parser.add_argument("--I", type=int, default=1000)
+    parser.add_argument("--strikes", type=float, nargs="+", default=[100.])
+    parser.add_argument("--type", default="call")
+    parser.add_argument("--opt", default="european")
+    parser.add_argument("--n-jobs", type=int, default=-1)
+    parser.add_argument("--out", help="csv or parquet file for the table of all runs")
+    args = parser.parse_args()
+
+    runs, summary = study(range(args.seeds), args.nbins, args.methods, args.reference, {"M": args.M, "I": args.I},
+        args.strikes, args.type, args.opt, args.n_jobs)
+    print(summary.to_string(index=False))
+    if args.out:
+        if args.out.endswith(".parquet"):
+            runs.to_parquet(args.out)
+        else:
+            runs.to_csv(args.out, index=False)
@@ -1,28 +1,56 @@
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 import matplotlib.colors as colors
+from matplotlib.collections import PatchCollection
 import random
 import numpy as np
 
 def rgb_to_hex(rgb):
     return '%02x%02x%02x' % rgb
 
-def draw_graph(bins1, bins2, S):
+def bin_patches(bins, x_offset=-0.5, width=1, color=None, **kwargs):
+    """
+    One PatchCollection with a rectangle per bin and timestep instead of one patch each
+
+    Every bin gets a random color unless `color` is given.
+    """
+    rects, facecolors = [], []
+    for x in bins.keys():
+        c = color if color is not None else (random.random(), random.random(), random.random())
+        for idx, i in enumerate(bins[x].values()):
+            rects.append(patches.Rectangle((idx+x_offset, min(i)), width, max(i)-min(i)))
+            facecolors.append(c)
+    return PatchCollection(rects, facecolors=facecolors, edgecolor="none", **kwargs)
+
+def draw_paths(ax, S, alpha, max_paths=1000, resolution=200):
+    """
+    Draw the paths as lines, or as 2-D histogram of their density if there are more than `max_paths`
+    """
+    S = np.asarray(S)
+    if S.shape[1] <= max_paths:
+        ax.plot(S, alpha=alpha, color="black")
+        return
+    n_t, I = S.shape
+    hist, _, y_edges = np.histogram2d(np.repeat(np.arange(n_t), I), S.ravel(), bins=[np.arange(n_t+1)-0.5, resolution])
+    ax.pcolormesh(np.arange(n_t+1)-0.5, y_edges, hist.T, norm=colors.LogNorm(), cmap="Greys")
+
+def show(fig, file=None):
+    """
+    Save the figure to `file` for headless use or show it
+    """
+    if file is not None:
+        fig.savefig(file)
+        plt.close(fig)
+    else:
+        plt.show()
+
+def draw_graph(bins1, bins2, S, file=None, max_paths=1000):
     fig1 = plt.figure()
     ax1 = fig1.add_subplot(211)
 
-    for x in bins1.keys():
-        r = random.random()
-        b = random.random()
-        g = random.random()
-        color = (r, g, b)
-        for idx, i in enumerate(bins1[x].values()):
-            ax1.add_patch(
-                    patches.Rectangle((idx-0.5, min(i)), 1, max(i)-min(i), color=color, alpha=.5)
-                    )
-            # ax1.violinplot(i, positions=[idx])
+    ax1.add_collection(bin_patches(bins1, alpha=.5))
 
-    ax1.plot(S, alpha=.05, color="black")
+    draw_paths(ax1, S, .05, max_paths)
     ax1.grid(True)
     ax1.set_ylim((0,200))
     ax1.set_xlim((0, len(bins1[list(bins1.keys())[0]].keys())))
@@ -31,18 +59,9 @@ def draw_graph(bins1, bins2, S):
 
     if bins2:
         ax2 = fig1.add_subplot(212)
-        for x in bins2.keys():
-            r = random.random()
-            b = random.random()
-            g = random.random()
-            color = (r, g, b)
-            for idx, i in enumerate(bins2[x].values()):
-                ax2.add_patch(
-                        patches.Rectangle((idx-0.5, min(i)), 1, max(i)-min(i), color=color, alpha=.5)
-                        )
-                # ax2.violinplot(i, positions=[idx])
+        ax2.add_collection(bin_patches(bins2, alpha=.5))
 
-        ax2.plot(S, alpha=.05, color="black")
+        draw_paths(ax2, S, .05, max_paths)
         ax2.grid(True)
         ax2.set_ylim((0, 200))
         ax2.set_xlim((0, len(bins2[list(bins2.keys())[0]].keys())))
@@ -51,22 +70,16 @@ def draw_graph(bins1, bins2, S):
 
     plt.tight_layout()
     #plt.figtext(0, 0.001, "time m1: \ntime m2:", wrap=True)
-    plt.show()
+    show(fig1, file)
 
-def draw_overlap(bins1, bins2, S=None, bin=[0], label= ["bins1", "bins2"], title=""):
+def draw_overlap(bins1, bins2, S=None, bin=[0], label= ["bins1", "bins2"], title="", file=None, max_paths=1000):
     fig1 = plt.figure()
     ax1 = fig1.add_subplot(211)
-    for x in bins1.keys(): #bins
-        if x in ["".join(["bin", str(i)]) for i in bin]:
-            for idx, (i, j) in enumerate(zip(bins1[x].values(), bins2[x].values())): #idx=t
-                    ax1.add_patch(
-                            patches.Rectangle((idx-0.5, min(i)), 0.5, max(i)-min(i), color=(1.0, 0.84, 0.17), alpha=0.5, label=label[0] if idx==0 else None)
-                            )
-                    ax1.add_patch(
-                            patches.Rectangle((idx, min(j)), 0.5, max(j)-min(j), color=(0.35, 0.36, 0.91), alpha=0.5, label=label[1] if idx==0 else None)
-                            )
+    keys = ["".join(["bin", str(i)]) for i in bin]
+    ax1.add_collection(bin_patches({x: bins1[x] for x in bins1.keys() if x in keys}, -0.5, 0.5, (1.0, 0.84, 0.17), alpha=0.5, label=label[0]))
+    ax1.add_collection(bin_patches({x: bins2[x] for x in bins1.keys() if x in keys}, 0, 0.5, (0.35, 0.36, 0.91), alpha=0.5, label=label[1]))
     if S is not None:
-        ax1.plot(S, alpha=.5, color="black")
+        draw_paths(ax1, S, .5, max_paths)
     ax1.grid(True)
     ax1.set_ylim((0, 200))
     ax1.set_xlim((0, len(bins1[list(bins1.keys())[0]].keys())))
@@ -76,9 +89,9 @@ def draw_overlap(bins1, bins2, S=None, bin=[0], label= ["bins1", "bins2"], title
     plt.title(title)
     plt.tight_layout()
     #plt.figtext(0, 0.001, "time m1: \ntime m2:", wrap=True)
-    plt.show()
+    show(fig1, file)
 
-def draw_diffs(diffs_dict):
+def draw_diffs(diffs_dict, file=None):
     fig1 = plt.figure()
     ax1 = fig1.add_subplot(111)
     for bin in diffs_dict.keys():
@@ -86,4 +99,4 @@ def draw_diffs(diffs_dict):
     ax1.set_xlabel("timesteps")
     ax1.set_ylabel("absolute difference")
     fig1.legend(loc=7)
-    plt.show()
+    show(fig1, file)
@@ -0,0 +1,28 @@
+import os
+import numpy as np
+from Cache import Cache
+
+def test_directory_created_on_first_put(tmp_path):
+    path = str(tmp_path / "cache")
+    cache = Cache(path)
+    assert not os.path.exists(path)
+    assert cache.get_array("a") is None and cache.entries() == []
+    cache.put_array("a", np.arange(10))
+    assert np.array_equal(cache.get_array("a"), np.arange(10))
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_entry_removed_by_other_process(tmp_path):
+    cache = Cache(str(tmp_path))
+    cache.put("b", x=np.arange(10))
+    os.remove(cache._file("b", ".npz"))
+    assert cache.get("b") is None
+    assert cache.misses == 1
+    cache.evict()
+    cache.clear()
+
+def test_entry_larger_than_cache_is_not_stored(tmp_path):
+    cache = Cache(str(tmp_path), max_bytes=1000)
+    cache.put_array("small", np.arange(10))
+    cache.put_array("large", np.arange(1000))
+    assert cache.get_array("large") is None
+    assert cache.get_array("small") is not None
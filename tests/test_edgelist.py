@@ -0,0 +1,25 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from Simulation import Simulation
+from Instrumentation import Callback
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# baseline edgelists of the paths in `data/paths.npy` with nbins=3, written by the original
+# loop based `create_edgelist`
+@pytest.mark.parametrize("method", ["fixed", "kmeans"])
+@pytest.mark.parametrize("unique_edges", [True, False])
+def test_create_edgelist_matches_baseline(method, unique_edges):
+    S = Simulation(cache=False, callback=Callback())
+    S.data = np.load(os.path.join(DATA, "paths.npy"))
+    S.binning(nbins=3, method=method).create_edgelist(unique_edges=unique_edges)
+    expected = pd.read_csv(os.path.join(DATA, f"edgelist_{method}_{'unique' if unique_edges else 'paths'}.csv"))
+
+    e = S.edgelist
+    assert len(e) == len(expected)
+    assert np.array_equal([pos[0] for pos in e["position_p"]], expected["t"])
+    for c in ["parent", "child", "prob"]:
+        np.testing.assert_allclose(e[c].to_numpy(dtype=float), expected[c], rtol=1e-9, err_msg=c)
+    assert e["par_value"].equals(e["parent"]) and e["ch_value"].equals(e["child"])
@@ -0,0 +1,34 @@
+import pandas as pd
+import pytest
+from Cache import Cache
+from Simulation import Simulation
+from Instrumentation import Callback
+
+def simulation(cache):
+    return Simulation(cache=cache, callback=Callback()).generate(M=5, I=1000, seed=3).binning(nbins=4).create_edgelist()
+
+@pytest.fixture
+def expected():
+    return simulation(False).extend(100).edgelist
+
+def test_extend_cached_edgelist(tmp_path, expected):
+    cache = Cache(str(tmp_path))
+    simulation(cache)
+    S = simulation(cache)
+    assert S.edgelist_key is not None
+    pd.testing.assert_frame_equal(S.extend(100).edgelist, expected)
+
+def test_extend_without_transition_counts(expected):
+    # like an edgelist of a cache entry written without the transition counts
+    S = simulation(False)
+    S.transition_counts = S.transition_first = None
+    pd.testing.assert_frame_equal(S.extend(100).edgelist, expected)
+
+def test_extend_matches_recount():
+    S = simulation(False).extend(100)
+    fresh = Simulation(cache=False, callback=Callback())
+    fresh.bin_data, fresh.data = S.bin_data, S.data
+    fresh.recount_transitions()
+    M = len(S.data)-1
+    edgelist = fresh.build_edgelist([fresh.merge_nodes(i, S.bin_data.mean) for i in range(M)])
+    pd.testing.assert_frame_equal(S.edgelist, edgelist)
@@ -0,0 +1,22 @@
+import numpy as np
+from Simulation import Simulation
+from Tree import Tree
+from Greeks import Greeks
+from Instrumentation import Callback
+
+def test_shared_bins_match_independent_pipelines(capsys):
+    S = Simulation(cache=False, callback=Callback()).generate(M=5, I=2000, seed=1)
+    g = Greeks(S, nbins=4, batches=0)
+    res = g.calc(100, opt="american", discount=0.99)
+    prices = []
+    for s, v, r in g.scenarios:
+        sim = Simulation(cache=False, callback=Callback())
+        sim.data = g.bump(S.data, s*g.dS, v*g.dsigma, r*g.dr)
+        sim.binning(nbins=4).create_edgelist()
+        prices.append(Tree().from_S(sim).calc_option_value(100, 0.99, opt="american").option_price)
+    assert np.isclose(res.loc["price", "value"], prices[0])
+    assert np.isclose(res.loc["delta", "value"], (prices[1]-prices[2])/(2*g.dS))
+    assert np.isclose(res.loc["vega", "value"], (prices[3]-prices[4])/(2*g.dsigma))
+    assert np.isclose(res.loc["rho", "value"], (prices[5]-prices[6])/(2*g.dr))
+    # no progress bars of the scenarios
+    assert capsys.readouterr().err == ""
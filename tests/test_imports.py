@@ -0,0 +1,10 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "misc"))
+from benchmarks import bench_import
+
+def test_pricing_imports_stay_light():
+    res = bench_import(modules=("Lattice", "Tree"), budget=1.0)
+    assert res["loaded"] == [], f"heavy packages imported: {res['loaded']}"
+    assert res["seconds"] <= res["budget"], f"import took {res['seconds']:.2f}s"
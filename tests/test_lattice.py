@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from Simulation import Simulation
+from Lattice import Lattice
+from Instrumentation import Callback
+
+def lattice(seed, nbins):
+    S = Simulation(cache=False, callback=Callback()).generate(M=5, I=1000, seed=seed).binning(nbins=nbins).create_edgelist()
+    return Lattice.from_edgelist(S.edgelist)
+
+def test_stack_prices_every_lattice():
+    lattices = [lattice(0, 2), lattice(1, 4), lattice(2, 3)]
+    stacked, roots = Lattice.stack(lattices)
+    assert np.array_equal(stacked.roots(np.repeat(np.arange(3), [l.offsets[1] for l in lattices])), roots)
+    ev = stacked.backward_induction([90., 110.], 0.99, ["call", "put"], "american", all_nodes=False)
+    for l, root in zip(lattices, roots):
+        assert np.allclose(ev[root], l.backward_induction([90., 110.], 0.99, ["call", "put"], "american",
+            all_nodes=False)[l.root])
+
+def test_stack_of_stacks():
+    first, second, third = lattice(0, 2), lattice(1, 4), lattice(2, 3)
+    inner, inner_roots = Lattice.stack([first, second])
+    outer, roots = Lattice.stack([third, inner], [third.root, inner_roots])
+    flat = Lattice.stack([third, first, second])[1]
+    assert np.array_equal(roots, flat)
+    assert np.allclose(outer.backward_induction(100., 0.99, all_nodes=False)[roots[1:]],
+        inner.backward_induction(100., 0.99, all_nodes=False)[inner_roots])
+
+def test_unknown_contracts_are_rejected():
+    l = lattice(0, 4)
+    for type, opt in [("call", "americn"), ("cal", "european")]:
+        with pytest.raises(ValueError, match="unknown"):
+            l.backward_induction(100., 0.99, type, opt)
+    strike, discount, type, opt = Lattice.contracts([90., 100.], 0.99, "p", ["european", "american"])
+    assert list(opt) == ["european", "american"] and list(type) == ["p", "p"] and len(discount) == 2
@@ -0,0 +1,67 @@
+import asyncio
+import pytest
+from Cache import Cache
+from Service import PricingService, PricingClient
+
+SIMULATION = {"M": 5, "I": 1000}
+
+def test_invalid_request_does_not_fail_batch(tmp_path):
+    async def main():
+        service = PricingService(max_delay=0.05, cache=Cache(str(tmp_path)))
+        good = service.price(SIMULATION, strike=100.)
+        bad = service.price(SIMULATION, strike=100., type="bogus")
+        return service, await asyncio.gather(good, bad, return_exceptions=True)
+
+    service, (good, bad) = asyncio.run(main())
+    assert isinstance(good, list) and len(good) == 1
+    assert isinstance(bad, ValueError)
+    assert service.stats()["requests"] == 1
+
+def test_latencies_are_bounded(tmp_path):
+    async def main():
+        service = PricingService(max_delay=0, cache=Cache(str(tmp_path)), max_latencies=5)
+        for _ in range(10):
+            await service.price(SIMULATION, strike=100.)
+        return service
+
+    service = asyncio.run(main())
+    assert len(service.latencies) == 5
+    assert service.stats()["requests"] == 10
+
+def test_http_bad_parameters(tmp_path):
+    async def main():
+        service = PricingService(max_delay=0, cache=Cache(str(tmp_path)))
+        client = PricingClient(port=await service.start())
+        try:
+            errors = []
+            for simulation in [{"nbins": 0}, {"M": 0}, {"I": 1.5}, {"method": "bogus"}]:
+                with pytest.raises(ValueError) as e:
+                    await client.price(simulation={**SIMULATION, **simulation}, strike=100.)
+                errors.append(str(e.value))
+            # the connection survives the bad requests
+            return errors, await client.price(simulation=SIMULATION, strike=[90., 100.])
+        finally:
+            await client.close()
+            await service.stop()
+
+    errors, prices = asyncio.run(main())
+    assert [e.split(" ")[0] for e in errors] == ["nbins", "M", "I", "unknown"]
+    assert len(prices) == 2 and prices[0] > prices[1]
+
+def test_http_internal_error(tmp_path):
+    def build(key):
+        raise RuntimeError("boom")
+
+    async def main():
+        service = PricingService(max_delay=0, cache=Cache(str(tmp_path)))
+        service.build = build
+        client = PricingClient(port=await service.start())
+        try:
+            with pytest.raises(ValueError, match="RuntimeError: boom"):
+                await client.price(simulation=SIMULATION)
+            return await client.stats()
+        finally:
+            await client.close()
+            await service.stop()
+
+    assert asyncio.run(main())["requests"] == 0
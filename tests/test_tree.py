@@ -0,0 +1,34 @@
+import os
+import numpy as np
+from Simulation import Simulation
+from Tree import Tree
+from Instrumentation import Callback
+
+def tree():
+    S = Simulation(cache=False, callback=Callback()).generate(M=5, I=1000, seed=3).binning(nbins=4).create_edgelist()
+    return Tree().from_S(S)
+
+def test_save_load_keeps_other_files(tmp_path):
+    np.save(tmp_path / "mine.npy", np.arange(3))
+    t = tree().calc_option_value(100, 0.99)
+    t.save(str(tmp_path))
+    assert np.array_equal(np.load(tmp_path / "mine.npy"), np.arange(3))
+    loaded = Tree.load(str(tmp_path))
+    assert loaded.option_price == t.option_price
+    assert np.array_equal(loaded.ev, t.ev)
+
+def test_save_removes_stale_option_values(tmp_path):
+    tree().calc_option_value(100, 0.99).save(str(tmp_path))
+    tree().save(str(tmp_path))
+    assert not os.path.exists(tmp_path / "ev.npy")
+    assert Tree.load(str(tmp_path)).ev is None
+
+def test_edgelist_csv_roundtrip(tmp_path):
+    S = Simulation(cache=False, callback=Callback()).generate(M=5, I=1000, seed=3).binning(nbins=4).create_edgelist()
+    expected = Tree().from_S(S).calc_option_value(100, 0.99).option_price
+    S.edgelist.to_csv(tmp_path / "edgelist.csv", index=False)
+    loaded = Tree().from_edgelist(str(tmp_path / "edgelist.csv")).calc_option_value(100, 0.99)
+    assert np.isclose(loaded.option_price, expected)
+    # without readable positions the timesteps follow from the structure of the tree
+    S.edgelist.assign(position_p="?").to_csv(tmp_path / "other.csv", index=False)
+    assert np.isclose(Tree().from_edgelist(str(tmp_path / "other.csv")).calc_option_value(100, 0.99).option_price, expected)